@@ -0,0 +1,72 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from metrics import REGISTRY
+
+# Chats processed at once; further chats wait in a bounded queue
+MAX_CONCURRENT_CHATS = int(os.environ.get("MAX_CONCURRENT_CHATS", "8"))
+# Chats allowed to wait; beyond this new chats are rejected immediately
+MAX_QUEUED_CHATS = int(os.environ.get("MAX_QUEUED_CHATS", "16"))
+# A queued chat that gets no slot within this many seconds is rejected
+ADMISSION_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_TIMEOUT_SECONDS", "30"))
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted; the message is safe to show to users."""
+
+class AdmissionController:
+    """Max-concurrency gate with a bounded wait queue and fast rejection.
+
+    Usage: `async with controller.admit(): ...`. Must be used from one event
+    loop; the semaphore is (re)created for the running loop like
+    rag_engine.get_llm_semaphore.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_CHATS, max_queued: int = MAX_QUEUED_CHATS,
+                 timeout: float = ADMISSION_TIMEOUT_SECONDS, name: str = "chat"):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.name = name
+        self.active = 0
+        self.queued = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def admit(self):
+        semaphore = self._get_semaphore()
+        start = time.perf_counter()
+        if semaphore.locked():
+            if self.queued >= self.max_queued:
+                REGISTRY.inc(f"{self.name}_admission_rejected")
+                raise Overloaded("The assistant is at capacity right now. Please try again in a moment.")
+            self.queued += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                REGISTRY.inc(f"{self.name}_admission_timeouts")
+                raise Overloaded("The assistant is busy and your request timed out in the queue. Please try again.")
+            finally:
+                self.queued -= 1
+        else:
+            await semaphore.acquire()
+        REGISTRY.observe(f"{self.name}_admission_wait_seconds", time.perf_counter() - start)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict:
+        return {"active": self.active, "queued": self.queued,
+                "max_concurrent": self.max_concurrent, "max_queued": self.max_queued}
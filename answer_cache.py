@@ -0,0 +1,103 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Cosine similarity above which a different phrasing counts as the same question
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+class AnswerCache:
+    """LRU/TTL cache of final answers, keyed by model and query.
+
+    Lookups try an exact match on the normalized query first, then the most
+    similar previously answered query above `threshold` (cosine similarity
+    of query embeddings). Entries are dropped wholesale when the index
+    version changes, i.e. after re-ingestion.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        # (model, normalized query) -> (answer, unit query vector or None, stored_at)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, Optional[List[float]], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_version = None
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def check_index_version(self, version):
+        """Clear the cache if the vector store changed since answers were stored."""
+        with self._lock:
+            if version != self._index_version:
+                if self._entries:
+                    print("Answer cache invalidated: vector store changed.")
+                self._entries.clear()
+                self._index_version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self, now: float):
+        expired = [key for key, (_, _, stored_at) in self._entries.items() if now - stored_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, model_name: str, query: str, vector: Optional[List[float]] = None) -> Optional[str]:
+        key = (model_name, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if vector is not None:
+                query_vec = _unit(vector)
+                best_key, best_score = None, self.threshold
+                for entry_key, (_, entry_vec, _) in self._entries.items():
+                    if entry_key[0] != model_name or entry_vec is None:
+                        continue
+                    score = sum(a * b for a, b in zip(query_vec, entry_vec))
+                    if score >= best_score:
+                        best_key, best_score = entry_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return self._entries[best_key][0]
+
+            self.misses += 1
+            return None
+
+    def store(self, model_name: str, query: str, answer: str, vector: Optional[List[float]] = None):
+        key = (model_name, normalize_query(query))
+        with self._lock:
+            self._entries[key] = (answer, _unit(vector) if vector is not None else None, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits,
+                    "semantic_hits": self.semantic_hits, "misses": self.misses}
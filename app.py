@@ -22,9 +22,26 @@ if sys.version_info >= (3, 13):
     if original_remove_reader:
         selectors.BaseSelector._remove_reader = patched_remove_reader
 
-import gradio as gr
 import os
-from rag_engine import RAGHelper
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Only the UI stack is imported eagerly; rag_engine (LangChain, Chroma, torch) is
+# imported by the background warmup so the interface can be served right away.
+_import_start = time.perf_counter()
+import gradio as gr
+from metrics import RequestTrace, METRICS_PORT, start_metrics_server, set_health_check
+from warmup import WarmupState, start_background_warmup
+from admission import AdmissionController, Overloaded
+print(f"UI imports loaded in {time.perf_counter() - _import_start:.2f}s")
+
+# How long a chat request waits for warmup before asking the user to retry
+WARMUP_WAIT_SECONDS = float(os.environ.get("WARMUP_WAIT_SECONDS", "60"))
+WARMUP = WarmupState()
+CHAT_ADMISSION = AdmissionController()
 
 # Snapshot original environment to allow reverting/fallback
 ORIGINAL_ENV = {
@@ -41,80 +58,112 @@ def get_effective_config(ui_google_key, ui_gh_token, ui_gh_repo):
         "GITHUB_REPO": ui_gh_repo.strip() if (ui_gh_repo and ui_gh_repo.strip()) else ORIGINAL_ENV["GITHUB_REPO"]
     }
 
-# Pre-initialize RAG on Startup to avoid latency
-def initialize_rag(model_name: str = "gemini-2.5-flash"):
+# Pre-initialize RAG in the background so startup never blocks the UI
+def initialize_rag(state: WarmupState, model_name: str = "gemini-2.5-flash"):
     print(f"--- Initializing RAG Engine with {model_name} ---")
-    if not os.path.exists("chroma_db_v4"):
-        if os.environ.get("GOOGLE_API_KEY"):
+    with state.track("import_rag_engine"):
+        import rag_engine
+    with state.track("ticket_dispatcher"):
+        # Started eagerly so tickets left in the outbox by a previous process are filed after a restart
+        try:
+            from ticket_queue import get_ticket_dispatcher
+            get_ticket_dispatcher()
+        except Exception as e:
+            print(f"Ticket dispatcher failed to start: {e}")
+
+    if os.environ.get("GOOGLE_API_KEY"):
+        if not os.path.exists("chroma_db_v4"):
             print("Database not found. Starting background ingestion...")
+        # Incremental: only changed files are re-embedded, a no-op if nothing changed
+        with state.track("ingestion"):
             try:
                 from data_ingestion import ingest_data
-                ingest_data()
+                ingest_data(incremental=True)
             except Exception as e:
                 print(f"Startup Ingestion Failed: {e}")
-        else:
-            print("Warning: GOOGLE_API_KEY missing. Cannot build database.")
-    
-    # Pre-warm the solver
-    global rag_solver
+    elif not os.path.exists("chroma_db_v4"):
+        print("Warning: GOOGLE_API_KEY missing. Cannot build database.")
+
+    with state.track("load_retrieval"):
+        # Reopen the store in case ingestion just changed it; loads the embedding model
+        rag_engine.reset_retrieval_backend()
+        backend = rag_engine.get_retrieval_backend()
+    with state.track("dummy_embedding"):
+        vector = backend.embeddings.embed_query("warmup")
+    if backend.vectorstore is not None:
+        with state.track("first_query"):
+            backend.search("warmup", vector, k=rag_engine.RETRIEVAL_K)
+    else:
+        print("No vector store yet; skipping the warmup query.")
+    reranker = rag_engine.get_reranker()
+    if reranker is not None:
+        with state.track("reranker"):
+            try:
+                reranker.warm()
+            except Exception as e:
+                print(f"Reranker warmup failed: {e}")
+    router = rag_engine.get_intent_router()
+    if router is not None:
+        with state.track("intent_router"):
+            try:
+                router.warm()
+            except Exception as e:
+                print(f"Intent router warmup failed: {e}")
+
+    # Pre-warm the solver for the default (secrets-only) configuration
+    with state.track("llm_client"):
+        if get_solver(model_name, get_effective_config(None, None, None)):
+            print(f"RAG Engine Ready with {model_name}.")
+
+def warmup_status_text() -> str:
+    info = WARMUP.snapshot()
+    if info["status"] == "ready":
+        return f"🟢 Ready (started in {sum(info['timings'].values()):.1f}s)"
+    if info["status"] == "failed":
+        return f"🟠 Warmup failed, the engine will initialize on first question: {info['error']}"
+    return f"⏳ Warming up ({info['stage'] or 'starting'}, {info['uptime_seconds']:.0f}s)..."
+
+# Solvers per session configuration (model + credentials). Each one is cheap: the
+# embedder, stores and LLM clients behind it are shared pools.
+SOLVER_POOL_SIZE = 32
+_solvers: "OrderedDict[str, object]" = OrderedDict()
+_solvers_lock = threading.Lock()
+
+def get_solver(model_name: str, config: dict):
+    """RAGHelper for this model and configuration; nothing process-wide is mutated."""
+    key = hashlib.sha256(json.dumps([model_name, config], sort_keys=True).encode()).hexdigest()
+    with _solvers_lock:
+        if key in _solvers:
+            _solvers.move_to_end(key)
+            return _solvers[key]
     try:
         from rag_engine import RAGHelper
-        rag_solver = RAGHelper(model_name=model_name)
-        print(f"RAG Engine Ready with {model_name}.")
+        solver = RAGHelper(model_name=model_name, google_api_key=config["GOOGLE_API_KEY"],
+                           github_token=config["GITHUB_TOKEN"], github_repo=config["GITHUB_REPO"])
     except Exception as e:
-        print(f"RAG Pre-warm Error: {e}")
-
-# Global state to track active configuration
-rag_solver = None
-active_model = None
-active_google_key = None
-
-def get_solver(model_name: str, effective_google_key: str):
-    global rag_solver, active_model, active_google_key
-    
-    needs_init = (rag_solver is None or 
-                  model_name != active_model or 
-                  effective_google_key != active_google_key)
-    
-    if needs_init:
-        print(f"--- Re-initializing RAG Engine: Model={model_name} ---")
-        # Ensure the env var is set for current and downstream (tools) use
-        if effective_google_key:
-            os.environ["GOOGLE_API_KEY"] = effective_google_key
-            
-        try:
-            rag_solver = RAGHelper(model_name=model_name)
-            active_model = model_name
-            active_google_key = effective_google_key
-            print(f"RAG Engine successfully switched to {model_name}.")
-        except Exception as e:
-            print(f"Failed to switch model/key: {e}")
-            if rag_solver is None:
-                return None
-    return rag_solver
+        print(f"Failed to initialize RAG Engine for {model_name}: {e}")
+        return None
+    with _solvers_lock:
+        _solvers[key] = solver
+        while len(_solvers) > SOLVER_POOL_SIZE:
+            _solvers.popitem(last=False)
+    return solver
 
-def chat_logic(message, history, google_key, gh_token, gh_repo, model_name):
-    # 1. Resolve Configuration Hierarchy (UI > Secrets)
+async def chat_logic(message, history, google_key, gh_token, gh_repo, model_name):
+    # 1. Resolve Configuration Hierarchy (UI > Secrets); passed explicitly, never via os.environ
     config = get_effective_config(google_key, gh_token, gh_repo)
-    
-    # Sync environment so tools and LangChain see the high-priority values
-    for key, val in config.items():
-        if val:
-            os.environ[key] = val
-        else:
-            os.environ.pop(key, None) # Remove if both UI and Secret are missing
-    
-    if not os.environ.get("GOOGLE_API_KEY"):
+
+    if not config["GOOGLE_API_KEY"]:
          yield "⚠️ Please enter your Google API Key in the settings below or set GOOGLE_API_KEY in Space Secrets."
          return
 
-    # 2. Get Engine (handles dynamic switching)
-    solver = get_solver(model_name, config["GOOGLE_API_KEY"])
-    if not solver:
-        yield "❌ System Error: Failed to initialize AI Engine. Please check your API Key."
-        return
+    # 2. Wait for background warmup; the status message is replaced by the answer
+    if not WARMUP.wait(0):
+        yield f"{warmup_status_text()} Your question will be answered as soon as the engine is ready."
+        if not await WARMUP.wait_async(WARMUP_WAIT_SECONDS):
+            yield "⏳ The assistant is still starting up. Please try again in a moment."
+            return
 
-    # 3. Generate Response
     # Gradio 'history' with type="messages"
     chat_history_dicts = []
     for item in history:
@@ -123,15 +172,35 @@ def chat_logic(message, history, google_key, gh_token, gh_repo, model_name):
         elif isinstance(item, (list, tuple)) and len(item) >= 2:
             chat_history_dicts.append({"role": "user", "content": item[0]})
             chat_history_dicts.append({"role": "assistant", "content": item[1]})
-    
+
+    trace = RequestTrace("chat")
+    admitted = False
     try:
-        response_generator = solver.get_response_stream(message, chat_history_dicts)
-        partial_response = ""
-        for chunk in response_generator:
-            partial_response += chunk
-            yield partial_response
+        # 3. Admission: bounded concurrency, bounded queue, fast rejection when both are full
+        async with CHAT_ADMISSION.admit():
+            admitted = True
+            trace.record("admission_wait", trace.elapsed())
+
+            # 4. Get Engine for this session's configuration; may load models on first use, so keep it off the event loop
+            solver = await asyncio.to_thread(get_solver, model_name, config)
+            if not solver:
+                yield "❌ System Error: Failed to initialize AI Engine. Please check your API Key."
+                return
+
+            # 5. Generate Response (async path: a chat waits on I/O, not on a worker thread)
+            response_generator = solver.aget_response_stream(message, chat_history_dicts)
+            partial_response = ""
+            async for chunk in response_generator:
+                if not partial_response:
+                    trace.record("time_to_first_chunk", trace.elapsed())
+                partial_response += chunk
+                yield partial_response
+    except Overloaded as e:
+        yield f"🚦 {e}"
     except Exception as e:
         yield f"❌ Error during generation: {str(e)}"
+    finally:
+        trace.finish(model=model_name, history_messages=len(chat_history_dicts), admitted=admitted)
 
 # --- UI Setup ---
 # Load custom CSS (raw CSS content, no HTML tags)
@@ -155,8 +224,8 @@ with gr.Blocks(title="TechSolutions Support AI v1.1.0") as demo:
             </p>
         </div>
     """)
+    status_md = gr.Markdown(warmup_status_text())
 
-    
     # Settings Accordion
     with gr.Accordion("⚙️ Settings & API Configuration", open=False):
         with gr.Row():
@@ -229,6 +298,8 @@ with gr.Blocks(title="TechSolutions Support AI v1.1.0") as demo:
         submit_btn="Send",
         stop_btn="Stop",
         cache_examples=False,
+        # Admission is handled by CHAT_ADMISSION, which queues or rejects; Gradio must not serialize chats
+        concurrency_limit=None,
     )
 
     # Wire up the suggestion buttons
@@ -237,6 +308,9 @@ with gr.Blocks(title="TechSolutions Support AI v1.1.0") as demo:
     suggestion_3.click(fn=lambda: "Who do you work for and what is your contact info?", outputs=chat_input)
     suggestion_4.click(fn=lambda: "What does the tutorial say about defining functions?", outputs=chat_input)
     
+    # Refresh readiness whenever the page is (re)loaded
+    demo.load(fn=warmup_status_text, outputs=status_md)
+
     # Footer
     gr.HTML("""
         <div class="footer">
@@ -245,7 +319,10 @@ with gr.Blocks(title="TechSolutions Support AI v1.1.0") as demo:
     """)
     
 if __name__ == "__main__":
-    initialize_rag()
+    if METRICS_PORT:
+        set_health_check(lambda: {**WARMUP.snapshot(), "admission": CHAT_ADMISSION.stats()})
+        start_metrics_server(int(METRICS_PORT))
+    start_background_warmup(initialize_rag, WARMUP)
     # Launch with SSR disabled for stability
     demo.launch(css=custom_css, ssr_mode=False)
 
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from typing import Dict, Iterator, List, Set
+
+DEFAULT_BLOCK_SIZE = 32
+
+def question_id(record: Dict, line_no: int) -> str:
+    if record.get("id") is not None:
+        return str(record["id"])
+    return f"q{line_no}-" + hashlib.sha256(record["question"].encode("utf-8")).hexdigest()[:8]
+
+def read_questions(path: str) -> Iterator[Dict]:
+    """Question records ({"id"?, "question", "history"?, "scope"?}) with a guaranteed "id"."""
+    with open(path, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record["id"] = question_id(record, line_no)
+            yield record
+
+def completed_ids(output_path: str) -> Set[str]:
+    """IDs answered successfully in a previous run; the output file doubles as the checkpoint.
+
+    Failed answers don't count, so a resumed run retries them and appends a newer line.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if not record.get("error") and record.get("outcome") != "error":
+                    done.add(record["id"])
+            except (ValueError, KeyError):
+                # A line cut off by an interrupted run; that question is simply answered again
+                continue
+    return done
+
+def blocks(records: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    block = []
+    for record in records:
+        block.append(record)
+        if len(block) == size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart (rate <= 0 disables it)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class BatchRunner:
+    """Answers question records with a RAGHelper and appends one JSON line per answer.
+
+    Questions are embedded one block at a time with a single batched call;
+    answers are generated concurrently (at most `concurrency` at once, and
+    no more than `rate` LLM calls started per second).
+    """
+
+    def __init__(self, helper, output_path: str, block_size: int = DEFAULT_BLOCK_SIZE,
+                 concurrency: int = 4, rate: float = 0.0):
+        self.helper = helper
+        self.output_path = output_path
+        self.block_size = block_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = RateLimiter(rate)
+        self.written = 0
+        self.errors = 0
+
+    def write(self, out, record: Dict):
+        out.write(json.dumps(record, default=str) + "\n")
+        # Flushed per answer so an interrupted run resumes after the last complete line
+        out.flush()
+        self.written += 1
+
+    async def answer_one(self, record: Dict, vector: List[float], out):
+        async with self.semaphore:
+            await self.rate_limiter.wait()
+            start = time.perf_counter()
+            try:
+                result = await self.helper.aanswer(record["question"], record.get("history") or [],
+                                                   scope=record.get("scope"), query_vector=vector)
+                error = None
+            except Exception as e:
+                result, error = {"answer": None, "sources": [], "outcome": "error", "stages": {}}, str(e)
+            if error or result["outcome"] == "error":
+                self.errors += 1
+            self.write(out, {"id": record["id"], "question": record["question"], **result, "error": error,
+                             "seconds": round(time.perf_counter() - start, 6)})
+
+    async def run(self, records: Iterator[Dict]):
+        loop = asyncio.get_running_loop()
+        pending: Set[asyncio.Task] = set()
+        with open(self.output_path, "a") as out:
+            for block in blocks(records, self.block_size):
+                # One batched embedding call per block instead of one per question
+                vectors = await loop.run_in_executor(
+                    None, self.helper.embeddings.embed_documents, [record["question"] for record in block])
+                for record, vector in zip(block, vectors):
+                    pending.add(asyncio.create_task(self.answer_one(record, vector, out)))
+                # Embed the next block while this one is answered, but never hold more than two blocks
+                while len(pending) > self.block_size:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.gather(*pending)
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer questions from a JSONL file without the UI.")
+    parser.add_argument("input", help='JSONL with one {"id", "question", "history"?, "scope"?} per line.')
+    parser.add_argument("output", help="JSONL answers; re-running with the same output resumes where it stopped.")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--fake-llm", action="store_true", help="Use the local fake streaming LLM (no API key).")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake LLM streaming rate.")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Fake LLM delay before the first token.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Questions answered at once.")
+    parser.add_argument("--rate", type=float, default=0.0, help="Max LLM calls started per second (0: unlimited).")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Questions embedded per batched embedding call.")
+    parser.add_argument("--vector-backend", choices=["chroma", "flat"], default=None)
+    parser.add_argument("--use-answer-cache", action="store_true",
+                        help="Reuse cached answers (off by default so every question reaches the LLM).")
+    parser.add_argument("--execute-tools", action="store_true",
+                        help="Actually run tool calls such as ticket creation (default: only record them).")
+    parser.add_argument("--restart", action="store_true", help="Ignore and overwrite an existing output file.")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = completed_ids(args.output)
+    todo = (record for record in read_questions(args.input) if record["id"] not in done)
+    if done:
+        print(f"Resuming: {len(done)} questions already answered in {args.output}")
+
+    from rag_engine import RAGHelper
+    llm = None
+    if args.fake_llm:
+        from fake_llm import FakeStreamingLLM
+        llm = FakeStreamingLLM(tokens_per_second=args.tokens_per_second, first_token_latency=args.first_token_latency)
+    elif not os.environ.get("GOOGLE_API_KEY"):
+        parser.error("GOOGLE_API_KEY is not set; use --fake-llm to run without Gemini.")
+    helper = RAGHelper(model_name="fake-llm" if args.fake_llm else args.model,
+                       google_api_key=os.environ.get("GOOGLE_API_KEY"), llm=llm,
+                       use_answer_cache=args.use_answer_cache, vector_backend=args.vector_backend,
+                       execute_tools=args.execute_tools)
+
+    runner = BatchRunner(helper, args.output, block_size=args.block_size, concurrency=args.concurrency, rate=args.rate)
+    start = time.perf_counter()
+    asyncio.run(runner.run(todo))
+    elapsed = time.perf_counter() - start
+    rate = runner.written / elapsed if elapsed else 0.0
+    print(f"Answered {runner.written} questions ({runner.errors} errors) in {elapsed:.2f}s "
+          f"({rate:.2f} questions/s). Output: {args.output}")
+
+if __name__ == "__main__":
+    main()
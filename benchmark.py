@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+QUESTIONS_PATH = os.path.join("benchmarks", "questions.jsonl")
+RECALL_KS = [1, 3, 5, 10]
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "p50": round(pick(0.50), 6),
+        "p95": round(pick(0.95), 6),
+        "p99": round(pick(0.99), 6),
+        "max": round(ordered[-1], 6),
+    }
+
+def load_questions(path: str = QUESTIONS_PATH) -> List[Dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def is_relevant(doc, relevant: List[Dict]) -> bool:
+    source = os.path.basename(str(doc.metadata.get("source", "")))
+    for label in relevant:
+        if source != label["source"]:
+            continue
+        if "page" not in label or doc.metadata.get("page") == label["page"]:
+            return True
+    return False
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def bench_ingestion(data_path: str, db_path: str, use_embedding_cache: bool, workers: int,
+                    flat_index_dtype: Optional[str] = None, shards: int = 1, shard_by: str = "hash") -> Dict:
+    from data_ingestion import ingest_data
+    print(f"\n=== Ingestion ({data_path} -> {db_path}) ===")
+    summary = ingest_data(incremental=False, workers=workers, use_embedding_cache=use_embedding_cache,
+                          use_page_cache=use_embedding_cache,
+                          data_path=data_path, db_path=db_path, flat_index_dtype=flat_index_dtype,
+                          shards=shards, shard_by=shard_by)
+    seconds = summary["seconds"]
+    summary["chunks_per_second"] = round(summary["chunks"] / seconds, 2) if seconds else None
+    summary["pages_per_second"] = round(summary["pages"] / seconds, 2) if seconds else None
+    return summary
+
+def bench_retrieval(backend, questions: List[Dict]) -> Dict:
+    print(f"\n=== Retrieval ({len(questions)} labeled questions) ===")
+    max_k = max(RECALL_KS)
+    # Warm up the model and the store so the first query isn't an outlier
+    backend.search("warmup", backend.embeddings.embed_query("warmup"), k=max_k)
+
+    embed_times, search_times, total_times = [], [], []
+    hits = {k: 0 for k in RECALL_KS}
+    reciprocal_ranks = []
+    per_question = []
+    for q in questions:
+        t0 = time.perf_counter()
+        vector = backend.embeddings.embed_query(q["question"])
+        t1 = time.perf_counter()
+        docs = backend.search(q["question"], vector, k=max_k)
+        t2 = time.perf_counter()
+        embed_times.append(t1 - t0)
+        search_times.append(t2 - t1)
+        total_times.append(t2 - t0)
+
+        rank = next((i + 1 for i, doc in enumerate(docs) if is_relevant(doc, q["relevant"])), None)
+        for k in RECALL_KS:
+            if rank is not None and rank <= k:
+                hits[k] += 1
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        per_question.append({"id": q["id"], "rank": rank,
+                             "top_sources": [os.path.basename(str(d.metadata.get("source", ""))) for d in docs[:3]]})
+
+    n = len(questions) or 1
+    return {
+        "questions": len(questions),
+        "recall_at_k": {str(k): round(hits[k] / n, 4) for k in RECALL_KS},
+        "mrr_at_10": round(sum(reciprocal_ranks) / n, 4),
+        "latency_seconds": {
+            "embedding": percentiles(embed_times),
+            "search": percentiles(search_times),
+            "total": percentiles(total_times),
+        },
+        "per_question": per_question,
+    }
+
+async def _simulated_user(helper, questions: List[Dict], user: int, queries: int, ttfts: List[float], totals: List[float]):
+    for i in range(queries):
+        question = questions[(user + i) % len(questions)]["question"]
+        start = time.perf_counter()
+        first = None
+        async for _ in helper.aget_response_stream(question, []):
+            if first is None:
+                first = time.perf_counter() - start
+        totals.append(time.perf_counter() - start)
+        ttfts.append(first if first is not None else totals[-1])
+
+async def _run_users(helper, questions: List[Dict], users: int, queries: int):
+    ttfts: List[float] = []
+    totals: List[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_simulated_user(helper, questions, u, queries, ttfts, totals) for u in range(users)))
+    return ttfts, totals, time.perf_counter() - start
+
+def bench_end_to_end(backend, questions: List[Dict], users: int, queries: int, llm, use_reranker: bool = True) -> Dict:
+    from rag_engine import RAGHelper
+    print(f"\n=== End-to-end ({users} concurrent users x {queries} queries, fake LLM) ===")
+    # The answer cache would turn repeated questions into replays, so it is off here
+    helper = RAGHelper(model_name="fake-llm", retrieval=backend, use_answer_cache=False, llm=llm,
+                       use_reranker=use_reranker)
+    ttfts, totals, wall = asyncio.run(_run_users(helper, questions, users, queries))
+    return {
+        "users": users,
+        "queries_per_user": queries,
+        "requests": len(totals),
+        "wall_seconds": round(wall, 4),
+        "requests_per_second": round(len(totals) / wall, 3) if wall else None,
+        "time_to_first_token_seconds": percentiles(ttfts),
+        "total_seconds": percentiles(totals),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark with a fake streaming LLM.")
+    parser.add_argument("--data-path", default="data")
+    parser.add_argument("--db-path", default=None,
+                        help="Vector store to use. Defaults to a fresh temporary directory.")
+    parser.add_argument("--skip-ingest", action="store_true", help="Benchmark an existing --db-path as-is.")
+    parser.add_argument("--use-embedding-cache", action="store_true",
+                        help="Let ingestion reuse cached embeddings and parsed pages (measures warm re-ingest).")
+    parser.add_argument("--workers", type=int, default=1, help="Ingestion parse workers.")
+    parser.add_argument("--vector-backend", choices=["chroma", "flat"], default="chroma")
+    parser.add_argument("--flat-index", choices=["float16", "int8"], default="float16",
+                        help="Flat index precision written during ingestion (used with --vector-backend flat).")
+    parser.add_argument("--no-rerank", action="store_true", help="Disable cross-encoder reranking end-to-end.")
+    parser.add_argument("--shards", type=int, default=1, help="Vector store shards built during ingestion.")
+    parser.add_argument("--shard-by", choices=["hash", "source"], default="hash")
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated users.")
+    parser.add_argument("--queries-per-user", type=int, default=5)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake LLM streaming rate.")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="Fake LLM delay before the first token.")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    if args.skip_ingest and not args.db_path:
+        parser.error("--skip-ingest requires --db-path")
+    db_path = args.db_path or tempfile.mkdtemp(prefix="bench_chroma_")
+
+    from fake_llm import FakeStreamingLLM
+    from rag_engine import RetrievalBackend
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k != "output"} | {"db_path": db_path},
+    }
+    if not args.skip_ingest:
+        flat_dtype = args.flat_index if args.vector_backend == "flat" else None
+        results["ingestion"] = bench_ingestion(args.data_path, db_path, args.use_embedding_cache, args.workers, flat_dtype,
+                                               args.shards, args.shard_by)
+
+    questions = load_questions(args.questions)
+    open_start = time.perf_counter()
+    backend = RetrievalBackend(db_path, backend=args.vector_backend)
+    results["retrieval_open_seconds"] = round(time.perf_counter() - open_start, 4)
+    results["retrieval"] = bench_retrieval(backend, questions)
+
+    llm = FakeStreamingLLM(tokens_per_second=args.tokens_per_second, first_token_latency=args.first_token_latency)
+    results["end_to_end"] = bench_end_to_end(backend, questions, args.users, args.queries_per_user, llm,
+                                             use_reranker=not args.no_rerank)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    retrieval = results["retrieval"]
+    e2e = results["end_to_end"]
+    print("\n=== Summary ===")
+    if "ingestion" in results:
+        print(f"Ingestion: {results['ingestion']['chunks']} chunks in {results['ingestion']['seconds']:.2f}s "
+              f"({results['ingestion']['chunks_per_second']} chunks/s)")
+    print(f"Retrieval: recall@k {retrieval['recall_at_k']}, MRR@10 {retrieval['mrr_at_10']}, "
+          f"p95 {retrieval['latency_seconds']['total']['p95']}s")
+    print(f"End-to-end: TTFT p50 {e2e['time_to_first_token_seconds']['p50']}s, "
+          f"p95 {e2e['time_to_first_token_seconds']['p95']}s, {e2e['requests_per_second']} req/s")
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+
+CONTEXT_COMPRESSION_ENABLED = os.environ.get("CONTEXT_COMPRESSION", "1") != "0"
+# Only the first/last lines of a page are considered header or footer candidates
+FURNITURE_EDGE_LINES = 3
+# A line is furniture if it repeats on at least this share of a file's pages (and on 3+ pages)
+FURNITURE_MIN_PAGE_SHARE = 0.3
+FURNITURE_MIN_PAGES = 3
+# Headers and footers are short; longer repeated lines are left alone
+FURNITURE_MAX_LINE_CHARS = 120
+# Word n-gram containment above which a passage is a near-duplicate of a better-ranked one
+DUPLICATE_SHINGLE_SIZE = 5
+DUPLICATE_CONTAINMENT = 0.8
+
+def normalize_line(line: str) -> str:
+    # Digits vary between pages ("Page 12", "3.2 Section"), so they are masked
+    return re.sub(r"\d+", "#", re.sub(r"\s+", " ", line.strip().lower()))
+
+class FurnitureDetector:
+    """Counts header/footer candidates page by page, so pages can be streamed past it."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.pages = 0
+
+    def add(self, page: Document):
+        lines = [normalize_line(l) for l in page.page_content.splitlines()
+                 if l.strip() and len(l.strip()) <= FURNITURE_MAX_LINE_CHARS]
+        self.counts.update(set(lines[:FURNITURE_EDGE_LINES] + lines[-FURNITURE_EDGE_LINES:]))
+        self.pages += 1
+
+    def furniture(self) -> List[str]:
+        """Normalized lines repeated across enough of the pages seen so far."""
+        if self.pages < FURNITURE_MIN_PAGES:
+            return []
+        threshold = max(FURNITURE_MIN_PAGES, FURNITURE_MIN_PAGE_SHARE * self.pages)
+        return sorted(line for line, count in self.counts.items() if count >= threshold and line.strip("# "))
+
+def detect_page_furniture(pages: List[Document]) -> List[str]:
+    """Normalized header/footer lines repeated across the pages of one file."""
+    detector = FurnitureDetector()
+    for page in pages:
+        detector.add(page)
+    return detector.furniture()
+
+def load_page_furniture(manifest: Optional[Dict]) -> Dict[str, Set[str]]:
+    """Source path -> furniture lines, as recorded per file in the ingestion manifest."""
+    if not manifest:
+        return {}
+    return {path: set(state.get("furniture", [])) for path, state in manifest.get("files", {}).items()
+            if state.get("furniture")}
+
+def _merge_adjacent(docs: List[Document]) -> Tuple[List[Document], int]:
+    """Join chunks of the same source/page whose start_index ranges touch or overlap.
+
+    The result keeps the order of each merged run's best-ranked chunk.
+    """
+    groups: Dict[Tuple[Any, Any], List[Tuple[int, Document]]] = {}
+    singles: List[Tuple[int, Document]] = []
+    for rank, doc in enumerate(docs):
+        if isinstance(doc.metadata.get("start_index"), int):
+            groups.setdefault((doc.metadata.get("source"), doc.metadata.get("page")), []).append((rank, doc))
+        else:
+            singles.append((rank, doc))
+
+    merged: List[Tuple[int, Document]] = list(singles)
+    merges = 0
+    for members in groups.values():
+        members.sort(key=lambda item: item[1].metadata["start_index"])
+        run_rank, run_doc = members[0]
+        run_start, run_text = run_doc.metadata["start_index"], run_doc.page_content
+        for rank, doc in members[1:]:
+            start = doc.metadata["start_index"]
+            end = run_start + len(run_text)
+            if start <= end:
+                # Overlapping text is an exact slice (chunks are cut from the same page), so skip it
+                run_text += doc.page_content[end - start:]
+                run_rank = min(run_rank, rank)
+                merges += 1
+                continue
+            merged.append((run_rank, Document(page_content=run_text, metadata=run_doc.metadata, id=run_doc.id)))
+            run_rank, run_doc = rank, doc
+            run_start, run_text = start, doc.page_content
+        merged.append((run_rank, Document(page_content=run_text, metadata=run_doc.metadata, id=run_doc.id)))
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged], merges
+
+def _strip_furniture(doc: Document, furniture: Set[str]) -> Tuple[Document, int]:
+    lines = doc.page_content.splitlines()
+    kept = [line for line in lines if normalize_line(line) not in furniture]
+    if len(kept) == len(lines):
+        return doc, 0
+    return Document(page_content="\n".join(kept), metadata=doc.metadata, id=doc.id), len(lines) - len(kept)
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < DUPLICATE_SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + DUPLICATE_SHINGLE_SIZE]) for i in range(len(words) - DUPLICATE_SHINGLE_SIZE + 1)}
+
+def compress_context(docs: Iterable[Document], furniture: Dict[str, Set[str]]) -> Tuple[List[Document], Dict[str, int]]:
+    """Merge adjacent chunks, strip page furniture and drop near-duplicates.
+
+    Documents keep their source/page metadata, so citations are unchanged;
+    input order (retrieval rank) is preserved.
+    """
+    docs, merges = _merge_adjacent(list(docs))
+
+    furniture_lines = 0
+    stripped = []
+    for doc in docs:
+        doc, removed = _strip_furniture(doc, furniture.get(doc.metadata.get("source"), set()))
+        furniture_lines += removed
+        if doc.page_content.strip():
+            stripped.append(doc)
+
+    kept: List[Document] = []
+    kept_shingles: List[Set[Tuple[str, ...]]] = []
+    duplicates = 0
+    for doc in stripped:
+        shingles = _shingles(doc.page_content)
+        if shingles and any(len(shingles & other) >= DUPLICATE_CONTAINMENT * len(shingles) for other in kept_shingles):
+            duplicates += 1
+            continue
+        kept.append(doc)
+        kept_shingles.append(shingles)
+    return kept, {"merged": merges, "furniture_lines": furniture_lines, "duplicates": duplicates}
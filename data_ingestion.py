@@ -1,74 +1,840 @@
 import os
 import glob
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+import json
+import time
+import heapq
+import queue
+import shutil
+import hashlib
+import argparse
+import threading
+from collections import Counter, deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+from pypdf import PdfReader, __version__ as PYPDF_VERSION
+from langchain_community.document_loaders import TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 from dotenv import load_dotenv
+from embedding_cache import (EMBEDDING_MODEL, EMBEDDING_CACHE_DIR, DEFAULT_BATCH_SIZE,
+                             EmbeddingCache, CachedEmbeddings, build_embeddings)
+from lexical_index import LEXICAL_INDEX_FILE, build_lexical_index
+from flat_index import FLAT_INDEX_DIR, FlatIndexWriter
+from context_compression import FurnitureDetector, detect_page_furniture
+from page_cache import PAGE_CACHE_DIR, PageCache
+from sharding import SHARDS_DIR, SHARD_STRATEGIES, shard_config, shard_for, shard_path
+from metrics import RequestTrace
 
 load_dotenv()
 
 DATA_PATH = "data"
 DB_PATH = "chroma_db_v4"
+# Per-file content hashes and chunk IDs of what is currently in the vector store
+MANIFEST_FILE = "ingest_manifest.json"
+MANIFEST_VERSION = 1
+# Large PDFs are split into page ranges of this size for parallel parsing
+PDF_PAGES_PER_TASK = 50
+# Bump when load_file/load_pdf_pages output changes; part of the page cache key with the pypdf version
+PAGE_LOADER_VERSION = 2
+PAGE_LOADER_KEY = f"v{PAGE_LOADER_VERSION}-pypdf{PYPDF_VERSION}"
+# Chunks buffered between the load/split thread and the embed/upsert loop
+STREAM_BUFFER_CHUNKS = 512
+# The manifest is checkpointed after this many upserted batches, so an interrupted run resumes from there
+CHECKPOINT_EVERY_BATCHES = 20
+PROGRESS_EVERY_SECONDS = 5.0
+# Chunks fetched per store read when the BM25 and flat indexes are rebuilt
+STORE_PAGE_SIZE = 1000
 
-def load_documents() -> List[Document]:
+def get_page_cache() -> PageCache:
+    return PageCache(PAGE_LOADER_KEY, PAGE_CACHE_DIR)
+
+def list_source_files(data_path: str = DATA_PATH) -> List[str]:
+    """All ingestible files under data_path, PDFs first, in a stable order."""
+    pdf_files = sorted(glob.glob(os.path.join(data_path, "*.pdf")))
+    text_files = sorted(glob.glob(os.path.join(data_path, "*.txt")))
+    return pdf_files + text_files
+
+def file_hash(path: str) -> str:
+    """SHA-256 of the file contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_file(path: str) -> List[Document]:
+    if path.endswith(".pdf"):
+        print(f"Loading PDF: {path}")
+        return load_pdf_pages(path, 0, None)
+    print(f"Loading Text: {path}")
+    return TextLoader(path).load()
+
+def pdf_info_metadata(reader: PdfReader) -> Dict[str, str]:
+    """Document info (producer, creator, creationdate, ...) as lower-case string fields."""
+    try:
+        info = reader.metadata or {}
+    except Exception:
+        return {}
+    return {key.lstrip("/").lower(): str(value) for key, value in info.items() if value is not None}
+
+def load_pdf_pages(path: str, start: int, end: Optional[int]) -> List[Document]:
+    """Parse pages [start, end) of a PDF (to the last page when end is None).
+
+    Every PDF is parsed here, whole or by page range, so all pages carry the
+    same metadata: the document info fields plus source, page, page_label
+    and total_pages.
+    """
+    reader = PdfReader(path)
+    total_pages = len(reader.pages)
+    try:
+        labels = reader.page_labels
+    except Exception:
+        labels = None
+    info = pdf_info_metadata(reader)
     documents = []
-    
-    # Load PDFs
-    pdf_files = glob.glob(os.path.join(DATA_PATH, "*.pdf"))
-    for pdf_file in pdf_files:
-        print(f"Loading PDF: {pdf_file}")
-        try:
-            loader = PyPDFLoader(pdf_file)
-            documents.extend(loader.load())
-        except Exception as e:
-            print(f"Error loading {pdf_file}: {e}")
-
-    # Load Text files
-    text_files = glob.glob(os.path.join(DATA_PATH, "*.txt"))
-    for text_file in text_files:
-        print(f"Loading Text: {text_file}")
-        try:
-            loader = TextLoader(text_file)
-            documents.extend(loader.load())
-        except Exception as e:
-            print(f"Error loading {text_file}: {e}")
-            
+    for i in range(start, total_pages if end is None else min(end, total_pages)):
+        metadata = {**info, "source": path, "page": i, "total_pages": total_pages}
+        if labels:
+            metadata["page_label"] = labels[i]
+        documents.append(Document(page_content=reader.pages[i].extract_text(), metadata=metadata))
     return documents
 
-def ingest_data():
-    if not os.environ.get("GOOGLE_API_KEY"):
-        print("Error: GOOGLE_API_KEY not found in environment variables.")
-        return
+def plan_load_tasks(files: List[str]) -> List[Tuple[str, int, int]]:
+    """Split files into (path, start_page, end_page) tasks; -1 means the whole file."""
+    tasks = []
+    for path in files:
+        if path.endswith(".pdf"):
+            try:
+                total_pages = len(PdfReader(path).pages)
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            if total_pages > PDF_PAGES_PER_TASK:
+                for start in range(0, total_pages, PDF_PAGES_PER_TASK):
+                    tasks.append((path, start, start + PDF_PAGES_PER_TASK))
+                continue
+        tasks.append((path, -1, -1))
+    return tasks
+
+def _run_load_task(task: Tuple[str, int, int]):
+    """Worker entry point. Returns (docs, seconds, error) so one bad file doesn't abort the pool."""
+    path, start, end = task
+    t0 = time.perf_counter()
+    try:
+        docs = load_file(path) if start < 0 else load_pdf_pages(path, start, end)
+        return docs, time.perf_counter() - t0, None
+    except Exception as e:
+        return [], time.perf_counter() - t0, str(e)
 
-    print("Loading documents...")
-    raw_documents = load_documents()
-    print(f"Loaded {len(raw_documents)} raw document pages/files.")
+def load_files(files: List[str], workers: int = 1, page_cache: Optional[PageCache] = None,
+               hashes: Optional[Dict[str, str]] = None) -> Dict[str, List[Document]]:
+    """Load files into {path: pages}, keyed and ordered like `files`.
 
-    print("Splitting text...")
-    text_splitter = RecursiveCharacterTextSplitter(
+    With workers > 1, files (and large PDFs, page range by page range) are
+    parsed in a process pool. Results are reassembled in task order, and
+    whole PDFs and page ranges go through the same parser (load_pdf_pages),
+    so the output is identical to a sequential load. Files that fail are omitted.
+    With a page_cache, files parsed before (same content hash) are read back
+    from it and newly parsed files are added to it.
+    """
+    cached: Dict[str, List[Document]] = {}
+    if page_cache is not None:
+        hashes = hashes or {path: file_hash(path) for path in files}
+        for path in files:
+            pages = page_cache.load(path, hashes[path])
+            if pages is not None:
+                cached[path] = pages
+    to_parse = [path for path in files if path not in cached]
+
+    if workers <= 1:
+        tasks = [(path, -1, -1) for path in to_parse]
+        results = map(_run_load_task, tasks)
+    else:
+        tasks = plan_load_tasks(to_parse)
+        print(f"Parsing {len(to_parse)} files as {len(tasks)} tasks on {workers} processes...")
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_run_load_task, tasks)
+
+    loaded: Dict[str, List[Document]] = {}
+    timings: Dict[str, float] = {}
+    failed = set()
+    try:
+        for (path, _, _), (docs, elapsed, error) in zip(tasks, results):
+            timings[path] = timings.get(path, 0.0) + elapsed
+            if error:
+                print(f"Error loading {path}: {error}")
+                failed.add(path)
+                continue
+            loaded.setdefault(path, []).extend(docs)
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+    for path in to_parse:
+        if path in timings:
+            print(f"  {path}: {len(loaded.get(path, []))} pages in {timings[path]:.2f}s")
+        if page_cache is not None and path in loaded and path not in failed:
+            page_cache.store(path, hashes[path], loaded[path])
+            page_cache.prune(path, hashes[path])
+    if page_cache is not None:
+        print(page_cache.report())
+    loaded.update(cached)
+    return {path: loaded[path] for path in files if path in loaded and path not in failed}
+
+def load_documents(files: Optional[List[str]] = None, workers: int = 1) -> List[Document]:
+    loaded = load_files(files if files is not None else list_source_files(), workers=workers)
+    return [doc for docs in loaded.values() for doc in docs]
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=100,
         length_function=len,
         add_start_index=True,
     )
-    chunks = text_splitter.split_documents(raw_documents)
-    print(f"Split into {len(chunks)} chunks.")
-
-    print("Creating vector store...")
-    # Initialize Google Embeddings (embedding-001 is the standard model)
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    
-    # Create and persist ChromaDB
-    # Note: Chroma is "serverless" in the sense it runs embedded without a separate server process for this scale
-    vectorstore = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=DB_PATH
-    )
-    print(f"Vector store created at {DB_PATH}")
+
+def chunk_id(path: str, content_hash: str, index: int) -> str:
+    return f"{os.path.basename(path)}:{content_hash[:16]}:{index}"
+
+def chunk_ids_for(path: str, content_hash: str, count: int) -> List[str]:
+    """Deterministic chunk IDs so unchanged files keep their vectors."""
+    return [chunk_id(path, content_hash, i) for i in range(count)]
+
+def iter_load_tasks(tasks: List[Tuple[str, int, int]], workers: int = 1) -> Iterator[Tuple]:
+    """Yield (task, docs, seconds, error) in task order.
+
+    With workers > 1 tasks run in a process pool, but at most 2 * workers
+    are submitted ahead of the consumer, so parsed pages never pile up.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield (task, *_run_load_task(task))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = iter(tasks)
+        window = deque((task, executor.submit(_run_load_task, task)) for task in islice(pending, 2 * workers))
+        while window:
+            task, future = window.popleft()
+            for next_task in islice(pending, 1):
+                window.append((next_task, executor.submit(_run_load_task, next_task)))
+            yield (task, *future.result())
+
+class LoadError(Exception):
+    pass
+
+# Error value of a (path, None, error) event meaning "this file's pages start over"
+RESTART_FILE = "restart"
+
+def _parsed_pages(path: str, results: Iterator[Tuple], count: int) -> Iterator[Document]:
+    """Pages of one file from the next `count` load results; raises LoadError if any range failed.
+
+    The file's parse time (summed over its tasks) is printed once its last task is in.
+    """
+    error = None
+    pages, seconds = 0, 0.0
+    for _ in range(count):
+        _, docs, elapsed, task_error = next(results)
+        seconds += elapsed
+        error = error or task_error
+        if not error:
+            pages += len(docs)
+            yield from docs
+    print(f"  {path}: {pages} pages in {seconds:.2f}s")
+    if error:
+        raise LoadError(error)
+
+def iter_source_pages(files: List[str], hashes: Dict[str, str], workers: int = 1,
+                      page_cache: Optional[PageCache] = None) -> Iterator[Tuple[str, Optional[Document], Optional[str]]]:
+    """Stream the pages of files in order as (path, page, None) events.
+
+    Each file ends with (path, None, None), or (path, None, error) if it
+    could not be loaded (pages already streamed for it must be discarded).
+    Cached files are read back from the page cache; the rest are parsed
+    page range by page range and cached as they stream past. A cache entry
+    that turns out to be unreadable is dropped and the file is parsed
+    instead, announced by (path, None, RESTART_FILE).
+    """
+    cached = {path for path in files if page_cache is not None and page_cache.has(path, hashes[path])}
+    to_parse = [path for path in files if path not in cached]
+    tasks = plan_load_tasks(to_parse)
+    if workers > 1 and tasks:
+        print(f"Parsing {len(to_parse)} files as {len(tasks)} tasks on {workers} processes...")
+    task_counts = Counter(path for path, _, _ in tasks)
+    results = iter_load_tasks(tasks, workers)
+    for path in files:
+        error = None
+        file_results, count = results, task_counts[path]
+        if path in cached:
+            try:
+                for page in page_cache.iter_pages(path, hashes[path]):
+                    yield path, page, None
+                page_cache.hits += 1
+                yield path, None, None
+                continue
+            except (OSError, EOFError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable page cache entry for {path}: {e}")
+                page_cache.discard(path, hashes[path])
+            yield path, None, RESTART_FILE
+            file_tasks = plan_load_tasks([path])
+            file_results, count = iter_load_tasks(file_tasks), len(file_tasks)
+
+        if not count:
+            yield path, None, "could not read file"
+            continue
+        pages = _parsed_pages(path, file_results, count)
+        if page_cache is not None:
+            page_cache.misses += 1
+            pages = page_cache.store_stream(path, hashes[path], pages)
+        try:
+            for page in pages:
+                yield path, page, None
+        except LoadError as e:
+            error = str(e)
+        if page_cache is not None and not error:
+            page_cache.prune(path, hashes[path])
+        yield path, None, error
+
+def stream_chunks(files: List[str], hashes: Dict[str, str], resume_from: Dict[str, int],
+                  workers: int = 1, page_cache: Optional[PageCache] = None,
+                  progress: Optional["IngestProgress"] = None) -> Iterator[Tuple]:
+    """Split streamed pages into chunk events.
+
+    Yields ("chunk", path, index, chunk) with per-file chunk indexes,
+    skipping the first resume_from[path] chunks of a file, then
+    ("done", path, {"chunks", "furniture"}) or ("failed", path, error).
+    Pages are split one at a time, which cuts the same chunks as splitting
+    the whole file since the splitter never crosses document boundaries.
+    """
+    text_splitter = get_text_splitter()
+    detector, index = FurnitureDetector(), 0
+    # Chunks of the current file already yielded; a restarted file skips them (same text, same IDs)
+    emitted = 0
+    for path, page, error in iter_source_pages(files, hashes, workers=workers, page_cache=page_cache):
+        if page is not None:
+            detector.add(page)
+            chunks = text_splitter.split_documents([page])
+            if progress is not None:
+                progress.pages += 1
+                progress.chunks += len(chunks)
+            for chunk in chunks:
+                if index >= max(resume_from.get(path, 0), emitted):
+                    yield "chunk", path, index, chunk
+                    emitted = index + 1
+                index += 1
+            continue
+        if error == RESTART_FILE:
+            detector, index = FurnitureDetector(), 0
+            continue
+        if error:
+            yield "failed", path, error
+        else:
+            # Repeated headers/footers are found once here and stripped from prompts at query time
+            yield "done", path, {"chunks": index, "furniture": detector.furniture()}
+        detector, index, emitted = FurnitureDetector(), 0, 0
+
+class _ProducerError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_END = object()
+
+class BoundedPrefetch:
+    """Runs an iterator on a background thread, at most maxsize items ahead of its consumer.
+
+    The producer blocks while the buffer is full (backpressure), so memory
+    is bounded by maxsize items however far ahead it could run. Producer
+    exceptions are re-raised in the consumer; stopping early stops the producer.
+    """
+
+    def __init__(self, items: Iterable, maxsize: int, name: str = "prefetch"):
+        self.items = items
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stop = threading.Event()
+        self.busy_seconds = 0.0
+        self.thread = threading.Thread(target=self._produce, name=name, daemon=True)
+
+    def _put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            iterator = iter(self.items)
+            while True:
+                start = time.perf_counter()
+                item = next(iterator, _END)
+                self.busy_seconds += time.perf_counter() - start
+                if not self._put(item) or item is _END:
+                    return
+        except BaseException as e:
+            self._put(_ProducerError(e))
+        finally:
+            close = getattr(self.items, "close", None)
+            if close:
+                close()
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _ProducerError):
+                    raise item.error
+                yield item
+        finally:
+            self.stop.set()
+            self.thread.join()
+
+class IngestProgress:
+    """Throughput of a streaming ingestion run: pages loaded, chunks split, chunks embedded and stored."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last_report = self.start
+        self.pages = 0
+        self.chunks = 0
+        self.embedded = 0
+
+    def report(self) -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (f"{self.pages} pages ({self.pages / elapsed:.1f}/s), {self.chunks} chunks ({self.chunks / elapsed:.1f}/s), "
+                f"{self.embedded} embedded ({self.embedded / elapsed:.1f}/s) in {elapsed:.1f}s")
+
+    def maybe_print(self):
+        now = time.perf_counter()
+        if now - self._last_report >= PROGRESS_EVERY_SECONDS:
+            self._last_report = now
+            print(f"Progress: {self.report()}")
+
+def stream_ingest(vectorstore: Chroma, files: List[str], hashes: Dict[str, str], files_state: Dict,
+                  checkpoint: Callable[[Dict], None], resume_from: Optional[Dict[str, int]] = None,
+                  workers: int = 1, batch_size: int = DEFAULT_BATCH_SIZE, page_cache: Optional[PageCache] = None,
+                  buffer_chunks: int = STREAM_BUFFER_CHUNKS, trace: Optional[RequestTrace] = None) -> IngestProgress:
+    """Load, split, embed and upsert files as one bounded stream.
+
+    A background thread parses and splits pages into a queue holding at most
+    buffer_chunks chunks; this thread embeds and upserts them batch_size at
+    a time, so loading and embedding memory depends on the buffer, not on
+    the corpus size.
+    files_state gets an entry per completed file. Every
+    CHECKPOINT_EVERY_BATCHES batches (and on interruption) checkpoint() is
+    given files_state with a partial entry for each file stored part-way,
+    so the next run resumes after the last stored chunk.
+    """
+    trace = trace or RequestTrace("ingest")
+    resume_from = resume_from or {}
+    progress = IngestProgress()
+    stored = dict(resume_from)  # path -> chunks of a not yet completed file already in the store
+    finished: Dict[str, Dict] = {}  # path -> "done" info, waiting for its last chunks to be stored
+    batch: List[Tuple[str, int, Document]] = []
+    batches = 0
+
+    def complete_finished():
+        for path, info in list(finished.items()):
+            if stored.get(path, 0) >= info["chunks"]:
+                files_state[path] = {"hash": hashes[path], "chunk_ids": chunk_ids_for(path, hashes[path], info["chunks"]),
+                                     "furniture": info["furniture"]}
+                print(f"Indexed {info['chunks'] - resume_from.get(path, 0)} chunks from {path}")
+                stored.pop(path, None)
+                del finished[path]
+
+    def save_checkpoint():
+        for path, count in stored.items():
+            if count:
+                files_state[path] = {"partial_hash": hashes[path], "loader": PAGE_LOADER_KEY, "chunks_done": count,
+                                     "chunk_ids": chunk_ids_for(path, hashes[path], count)}
+        checkpoint(files_state)
+
+    def flush():
+        nonlocal batches
+        if not batch:
+            return
+        with trace.stage("embed_upsert"):
+            vectorstore.add_documents([chunk for _, _, chunk in batch],
+                                      ids=[chunk_id(path, hashes[path], index) for path, index, _ in batch])
+        for path, index, _ in batch:
+            stored[path] = index + 1
+        progress.embedded += len(batch)
+        batch.clear()
+        batches += 1
+        complete_finished()
+        if batches % CHECKPOINT_EVERY_BATCHES == 0:
+            save_checkpoint()
+
+    prefetch = BoundedPrefetch(stream_chunks(files, hashes, resume_from, workers=workers, page_cache=page_cache,
+                                             progress=progress), maxsize=buffer_chunks, name="ingest-loader")
+    events = iter(prefetch)
+    try:
+        for event in events:
+            kind, path = event[0], event[1]
+            if kind == "chunk":
+                batch.append((path, event[2], event[3]))
+                if len(batch) >= batch_size:
+                    flush()
+            elif kind == "done":
+                finished[path] = event[2]
+                complete_finished()
+            else:
+                print(f"Error loading {path}: {event[2]}")
+                batch[:] = [item for item in batch if item[0] != path]
+                count = stored.pop(path, 0)
+                if count:
+                    vectorstore.delete(ids=chunk_ids_for(path, hashes[path], count))
+                files_state.pop(path, None)
+            progress.maybe_print()
+        flush()
+    except BaseException:
+        # Whatever reached the store is kept; the next run picks up from here
+        save_checkpoint()
+        raise
+    finally:
+        events.close()
+        trace.record("load_split", prefetch.busy_seconds)
+    print(f"Streamed {progress.report()}")
+    if page_cache is not None:
+        print(page_cache.report())
+    return progress
+
+def load_manifest(db_path: str = DB_PATH) -> Dict:
+    manifest_path = os.path.join(db_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(manifest: Dict, db_path: str = DB_PATH):
+    os.makedirs(db_path, exist_ok=True)
+    manifest_path = os.path.join(db_path, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def plan_changes(manifest: Optional[Dict], hashes: Dict[str, str]):
+    """Compare current file hashes with the manifest.
+
+    Returns (changed, removed): paths that need (re-)ingesting and manifest
+    entries whose files are gone.
+    """
+    known = manifest["files"] if manifest else {}
+    changed = [path for path, h in hashes.items() if known.get(path, {}).get("hash") != h]
+    removed = [path for path in known if path not in hashes]
+    return changed, removed
+
+def iter_stored_pages(store: Chroma, include: List[str], page_size: int = STORE_PAGE_SIZE) -> Iterator[Dict]:
+    """A store's chunks in ID order, page_size at a time, as {"ids", *include} column lists."""
+    ids = sorted(store.get(include=[])["ids"])
+    for start in range(0, len(ids), page_size):
+        page = store.get(ids=ids[start:start + page_size], include=include)
+        # get(ids=...) does not promise the requested order
+        order = sorted(range(len(page["ids"])), key=lambda i: page["ids"][i])
+        yield {key: [page[key][i] for i in order] for key in ["ids"] + include}
+
+def iter_stored_texts(stores: List[Chroma]) -> Iterator[Tuple[str, str]]:
+    """(chunk_id, text) over all stores in global ID order, read page by page."""
+    streams = [((chunk_id, text) for page in iter_stored_pages(store, ["documents"])
+                for chunk_id, text in zip(page["ids"], page["documents"])) for store in stores]
+    return heapq.merge(*streams)
+
+def write_store_flat_index(store: Chroma, path: str, dtype: str):
+    writer = FlatIndexWriter(path, dtype)
+    for page in iter_stored_pages(store, ["documents", "metadatas", "embeddings"]):
+        writer.add(page["ids"], page["documents"], page["metadatas"], page["embeddings"])
+    writer.close()
+
+def recorded_flat_index(db_path: str, manifest: Optional[Dict]) -> Optional[str]:
+    """dtype of the flat index kept under db_path, from the manifest or an existing index header."""
+    if manifest is not None and "flat_index" in manifest:
+        return manifest["flat_index"]
+    headers = [os.path.join(db_path, FLAT_INDEX_DIR, "header.json")]
+    headers += sorted(glob.glob(os.path.join(db_path, SHARDS_DIR, "*", FLAT_INDEX_DIR, "header.json")))
+    for header in headers:
+        try:
+            with open(header, "r") as f:
+                return json.load(f)["dtype"]
+        except (OSError, ValueError, KeyError):
+            continue
+    return None
+
+def remove_flat_indexes(db_path: str):
+    shutil.rmtree(os.path.join(db_path, FLAT_INDEX_DIR), ignore_errors=True)
+    for path in glob.glob(os.path.join(db_path, SHARDS_DIR, "*", FLAT_INDEX_DIR)):
+        shutil.rmtree(path, ignore_errors=True)
+
+def build_shard(task: Dict) -> Dict:
+    """Process-pool entry point: apply one shard's deletions and upserts to its own Chroma store."""
+    t0 = time.perf_counter()
+    embeddings = None
+    if task["chunks"]:
+        embeddings = build_embeddings(EMBEDDING_MODEL, batch_size=task["batch_size"])
+        if task["use_embedding_cache"]:
+            embeddings = CachedEmbeddings(embeddings, EmbeddingCache(EMBEDDING_MODEL, EMBEDDING_CACHE_DIR),
+                                          batch_size=task["batch_size"])
+    vectorstore = Chroma(persist_directory=task["path"], embedding_function=embeddings)
+    if task["stale_ids"]:
+        vectorstore.delete(ids=task["stale_ids"])
+    if task["chunks"]:
+        vectorstore.add_documents(task["chunks"], ids=task["ids"])
+    if task["flat_index_dtype"]:
+        write_store_flat_index(vectorstore, os.path.join(task["path"], FLAT_INDEX_DIR), task["flat_index_dtype"])
+    report = embeddings.report() if isinstance(embeddings, CachedEmbeddings) else None
+    return {"shard": task["shard"], "chunks": len(task["chunks"]), "deleted": len(task["stale_ids"]),
+            "seconds": time.perf_counter() - t0, "embedding_cache": report}
+
+def build_shards(tasks: List[Dict], workers: int = 1) -> List[Dict]:
+    """Run build_shard for every task, in a process pool when workers > 1 (one shard per process)."""
+    if workers <= 1 or len(tasks) <= 1:
+        return [build_shard(task) for task in tasks]
+    print(f"Building {len(tasks)} shards on {min(workers, len(tasks))} processes...")
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return list(executor.map(build_shard, tasks))
+
+def ingest_data(incremental: bool = False, workers: int = 1,
+                batch_size: int = DEFAULT_BATCH_SIZE, use_embedding_cache: bool = True,
+                data_path: str = DATA_PATH, db_path: str = DB_PATH,
+                flat_index_dtype: Optional[str] = None, shards: Optional[int] = None, shard_by: Optional[str] = None,
+                use_page_cache: bool = True, buffer_chunks: int = STREAM_BUFFER_CHUNKS) -> Dict:
+    """Build or update the vector store at db_path from the files under data_path.
+
+    With incremental=True only added or modified files are re-embedded and
+    the vectors of deleted files are removed; otherwise the collection is
+    rebuilt from scratch. Incremental mode falls back to a full rebuild when
+    no usable manifest exists. workers > 1 parses files in a process pool.
+    Chunk embeddings are served from the on-disk embedding cache when
+    possible; only new text is embedded, batch_size chunks at a time.
+    With flat_index_dtype ("float16" or "int8") a memory-mapped flat copy of
+    the collection is also written for the "flat" vector backend. The dtype
+    is recorded in the manifest and an existing flat index is rewritten on
+    every later ingest, so it never serves deleted chunks; "none" removes it.
+    With shards > 1 (files bucketed by name hash) or shard_by="source" (one
+    shard per file) chunks go to separate stores under db_path/shards/,
+    built in parallel by up to `workers` processes; changing the layout
+    forces a full rebuild. Leaving both as None keeps the layout recorded in
+    the manifest (unsharded for a new store), so the app's startup ingest
+    never undoes a sharded build.
+    Parsed pages are kept in the page cache (keyed by file hash and loader
+    version), so a rebuild re-splits cached text instead of re-parsing PDFs.
+    Unsharded stores are filled by stream_ingest in bounded memory
+    (buffer_chunks chunks between loading and embedding) with periodic
+    manifest checkpoints; a run that finds an interrupted checkpoint resumes
+    it instead of starting over. The first checkpoint is written before the
+    store is cleared or pruned, so an interrupted run is never mistaken for
+    a finished one.
+    Returns a summary of what was done with per-stage timings.
+    """
+
+    trace = RequestTrace("ingest")
+    with trace.stage("scan"):
+        files = list_source_files(data_path)
+        hashes = {path: file_hash(path) for path in files}
+
+    manifest = load_manifest(db_path)
+    if shards is None and shard_by is None and manifest is not None:
+        sharding = manifest.get("sharding")
+    else:
+        sharding = shard_config(shards or 1, shard_by or "hash")
+    recorded_flat = recorded_flat_index(db_path, manifest)
+    if flat_index_dtype is None:
+        # An existing flat index is kept in step with every ingest, not only --flat-index runs
+        flat_index_dtype = recorded_flat
+    elif flat_index_dtype == "none":
+        flat_index_dtype = None
+    flat_changed = flat_index_dtype != recorded_flat
+    if manifest is not None and manifest.get("in_progress") and manifest.get("reset"):
+        print("An interrupted rebuild had not finished clearing the old store. Rebuilding from scratch.")
+        manifest = None
+    elif manifest is not None and manifest.get("in_progress") and manifest.get("sharding") == sharding:
+        print("Resuming an interrupted ingestion run from its last checkpoint.")
+    elif not incremental:
+        manifest = None
+    elif manifest is None:
+        print("No ingestion manifest found. Falling back to a full rebuild.")
+    elif manifest.get("sharding") != sharding:
+        print("Shard layout changed. Falling back to a full rebuild.")
+        manifest = None
+    rebuild = manifest is None
+
+    changed, removed = plan_changes(manifest, hashes)
+    if not rebuild and not changed and not removed and not manifest.get("in_progress") and not flat_changed:
+        print(f"Vector store is up to date ({len(files)} files checked in {trace.elapsed():.2f}s).")
+        summary = {"files": len(files), "changed": 0, "removed": 0, "pages": 0, "chunks": 0}
+        trace.finish(**summary)
+        return {**summary, "seconds": trace.elapsed(), "stages": dict(trace.stages)}
+
+    print(f"Files to ingest: {len(changed)}, files to remove: {len(removed)}")
+
+    embeddings = None
+    vectorstore = None
+    if not sharding:
+        with trace.stage("open_store"):
+            embeddings = build_embeddings(EMBEDDING_MODEL, batch_size=batch_size)
+            if use_embedding_cache:
+                embeddings = CachedEmbeddings(embeddings, EmbeddingCache(EMBEDDING_MODEL, EMBEDDING_CACHE_DIR),
+                                              batch_size=batch_size)
+            # Note: Chroma is "serverless" in the sense it runs embedded without a separate server process for this scale
+            vectorstore = Chroma(persist_directory=db_path, embedding_function=embeddings)
+
+    files_state = {} if rebuild else dict(manifest["files"])
+    # Sharded: shard name -> {"stale_ids", "chunks", "ids"}, applied by build_shards
+    shard_work: Dict[str, Dict] = {}
+    # Vectors of removed and modified files are dropped before re-adding
+    stale_ids = []
+    resume_from: Dict[str, int] = {}
+    # Until their deletion has run, the checkpoint keeps these IDs (as entries without a hash, so a
+    # resumed run sees the file as changed and deletes them again)
+    unapplied: Dict[str, Dict] = {}
+    for path in removed + changed:
+        state = files_state.pop(path, {})
+        if (state.get("partial_hash") == hashes.get(path) and state.get("loader") == PAGE_LOADER_KEY
+                and not sharding):
+            # Stored part-way by an interrupted run: keep those chunks and continue after them
+            resume_from[path] = state["chunks_done"]
+            files_state[path] = state
+            continue
+        if not state.get("chunk_ids"):
+            continue
+        stale_ids.extend(state["chunk_ids"])
+        unapplied[path] = {key: state[key] for key in ("chunk_ids", "shard") if key in state}
+        if sharding:
+            work = shard_work.setdefault(state["shard"], {"stale_ids": [], "chunks": [], "ids": []})
+            work["stale_ids"].extend(state["chunk_ids"])
+
+    def checkpoint(state: Dict, reset: bool = False):
+        save_manifest({"version": MANIFEST_VERSION, "files": state, "sharding": sharding,
+                       "flat_index": flat_index_dtype, "in_progress": True, "reset": reset}, db_path)
+
+    # Written before the store is touched: a crash below must not leave a finished manifest
+    # describing a store that has already been cleared or pruned
+    checkpoint({**unapplied, **files_state}, reset=rebuild)
+    with trace.stage("delete"):
+        if rebuild:
+            # Also drops the shard stores of a previous layout when going back to one collection
+            shutil.rmtree(os.path.join(db_path, SHARDS_DIR), ignore_errors=True)
+        if rebuild and not sharding:
+            vectorstore.reset_collection()
+        if flat_changed and not flat_index_dtype:
+            remove_flat_indexes(db_path)
+        if stale_ids and not sharding:
+            vectorstore.delete(ids=stale_ids)
+            unapplied = {}
+        if stale_ids:
+            print(f"Deleted {len(stale_ids)} stale chunks.")
+    # Sharded deletions only happen in build_shards, so their IDs stay in the checkpoint until then
+    checkpoint({**unapplied, **files_state})
+    if resume_from:
+        print(f"Resuming {len(resume_from)} partially stored files.")
+
+    page_cache = get_page_cache() if use_page_cache else None
+    if sharding:
+        with trace.stage("load"):
+            loaded = load_files(changed, workers=workers, page_cache=page_cache, hashes=hashes)
+        total_pages = sum(len(d) for d in loaded.values())
+        print(f"Loaded {total_pages} raw document pages/files in {trace.stages['load']:.2f}s.")
+
+        text_splitter = get_text_splitter()
+        total_chunks = 0
+        for path, raw_documents in loaded.items():
+            with trace.stage("split"):
+                chunks = text_splitter.split_documents(raw_documents)
+            ids = chunk_ids_for(path, hashes[path], len(chunks))
+            shard = shard_for(path, sharding)
+            files_state[path] = {"hash": hashes[path], "chunk_ids": ids,
+                                 "furniture": detect_page_furniture(raw_documents), "shard": shard}
+            work = shard_work.setdefault(shard, {"stale_ids": [], "chunks": [], "ids": []})
+            work["chunks"].extend(chunks)
+            work["ids"].extend(ids)
+            print(f"Split {len(chunks)} chunks from {path} for shard {shard}")
+            total_chunks += len(chunks)
+        if flat_changed and flat_index_dtype:
+            # Unchanged shards need a flat index too
+            for shard in {state["shard"] for state in files_state.values() if "shard" in state}:
+                shard_work.setdefault(shard, {"stale_ids": [], "chunks": [], "ids": []})
+    else:
+        progress = stream_ingest(vectorstore, changed, hashes, files_state, checkpoint, resume_from=resume_from,
+                                 workers=workers, batch_size=batch_size, page_cache=page_cache,
+                                 buffer_chunks=buffer_chunks, trace=trace)
+        total_pages, total_chunks = progress.pages, progress.embedded
+
+    shard_reports = []
+    if sharding:
+        tasks = [{"shard": shard, "path": shard_path(db_path, shard), "batch_size": batch_size,
+                  "use_embedding_cache": use_embedding_cache, "flat_index_dtype": flat_index_dtype, **work}
+                 for shard, work in sorted(shard_work.items())]
+        with trace.stage("embed_upsert"):
+            shard_reports = build_shards(tasks, workers=workers)
+        for report in shard_reports:
+            print(f"Shard {report['shard']}: {report['chunks']} chunks added, {report['deleted']} deleted "
+                  f"in {report['seconds']:.2f}s")
+
+    # The BM25 index covers the whole collection, so it is rebuilt from the stored chunk texts (read in pages)
+    with trace.stage("lexical_index"):
+        if sharding:
+            stores = [Chroma(persist_directory=shard_path(db_path, shard))
+                      for shard in sorted({state["shard"] for state in files_state.values()})]
+        else:
+            stores = [vectorstore]
+        build_lexical_index(iter_stored_texts(stores), os.path.join(db_path, LEXICAL_INDEX_FILE))
+
+    if flat_index_dtype and not sharding:
+        with trace.stage("flat_index"):
+            write_store_flat_index(vectorstore, os.path.join(db_path, FLAT_INDEX_DIR), flat_index_dtype)
+
+    new_manifest = {"version": MANIFEST_VERSION, "files": files_state, "sharding": sharding,
+                    "flat_index": flat_index_dtype}
+    save_manifest(new_manifest, db_path)
+    if isinstance(embeddings, CachedEmbeddings):
+        print(embeddings.report())
+    for report in shard_reports:
+        if report["embedding_cache"]:
+            print(f"Shard {report['shard']} {report['embedding_cache']}")
+    print(f"Vector store updated at {db_path}: {total_chunks} chunks embedded in {trace.elapsed():.2f}s")
+    print("Stage timings: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in trace.stages.items()))
+    summary = {"files": len(files), "changed": len(changed), "removed": len(removed),
+               "pages": total_pages, "chunks": total_chunks,
+               "shards": len({state.get("shard") for state in files_state.values()}) if sharding else 1}
+    trace.finish(**summary)
+    return {**summary, "seconds": trace.elapsed(), "stages": dict(trace.stages)}
 
 if __name__ == "__main__":
-    ingest_data()
+    parser = argparse.ArgumentParser(description="Ingest documents into the vector store.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-embed added/changed files and drop removed ones.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Parse files in a process pool of this size (default: 1, sequential).")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of chunks per embedding batch.")
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help=f"Always re-embed instead of reusing vectors from {EMBEDDING_CACHE_DIR}/.")
+    parser.add_argument("--flat-index", choices=["float16", "int8", "none"], default=None,
+                        help="Also write a memory-mapped flat vector index (VECTOR_BACKEND=flat); it is then kept "
+                             "up to date by every ingest until 'none' removes it.")
+    parser.add_argument("--no-page-cache", action="store_true",
+                        help=f"Always re-parse files instead of reading cached pages from {PAGE_CACHE_DIR}/.")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Spread files over this many vector store shards by name hash "
+                             "(default: keep the current layout; 1 for a new store).")
+    parser.add_argument("--shard-by", choices=list(SHARD_STRATEGIES), default=None,
+                        help="'source' gives every file its own shard so queries can be routed to one document.")
+    parser.add_argument("--buffer-chunks", type=int, default=STREAM_BUFFER_CHUNKS,
+                        help="Chunks held between loading and embedding; bounds ingestion memory.")
+    args = parser.parse_args()
+    ingest_data(incremental=args.incremental, workers=args.workers,
+                batch_size=args.batch_size, use_embedding_cache=not args.no_embedding_cache,
+                flat_index_dtype=args.flat_index, shards=args.shards, shard_by=args.shard_by,
+                use_page_cache=not args.no_page_cache, buffer_chunks=args.buffer_chunks)
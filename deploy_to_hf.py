@@ -1,4 +1,5 @@
 import os
+import ast
 from huggingface_hub import HfApi, create_repo
 import glob
 
@@ -12,16 +13,57 @@ FILES_TO_UPLOAD = [
     "app.py",
     "rag_engine.py",
     "data_ingestion.py",
+    "embedding_cache.py",
+    "answer_cache.py",
+    "lexical_index.py",
+    "ticket_queue.py",
+    "prompt_builder.py",
+    "metrics.py",
+    "flat_index.py",
+    "warmup.py",
+    "reranker.py",
+    "context_compression.py",
+    "sharding.py",
+    "page_cache.py",
+    "admission.py",
+    "query_embedder.py",
+    "intent_router.py",
     "requirements.txt",
     "data/company_policies.txt",
     "data/library.pdf",
     "data/tutorial.pdf"
 ]
 
+def missing_local_modules(files):
+    """Local modules imported (anywhere, lazily too) by the uploaded scripts but not uploaded themselves."""
+    missing = set()
+    for file_path in files:
+        if not file_path.endswith(".py") or not os.path.exists(file_path):
+            continue
+        with open(file_path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=file_path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_file = name.split(".")[0] + ".py"
+                if os.path.exists(module_file) and module_file not in files:
+                    missing.add(module_file)
+    return sorted(missing)
+
 def deploy():
     api = HfApi(token=HF_TOKEN)
     repo_id = f"{USERNAME}/{SPACE_NAME}"
-    
+
+    missing = missing_local_modules(FILES_TO_UPLOAD)
+    if missing:
+        print(f"Error: these modules are imported but not in FILES_TO_UPLOAD: {', '.join(missing)}")
+        return
+
     print(f"Creating Space: {repo_id}...")
     try:
         create_repo(
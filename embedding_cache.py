@@ -0,0 +1,141 @@
+import os
+import re
+import time
+import struct
+import hashlib
+from array import array
+from typing import List, Dict, Optional
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = "embedding_cache"
+DEFAULT_BATCH_SIZE = 64
+
+# File layout: MAGIC, uint32 dimension, then fixed-size records of
+# sha256(text) (32 bytes) + dimension float32 values, appended in order.
+MAGIC = b"EMBC1\n"
+HEADER = struct.Struct("<I")
+DIGEST_SIZE = 32
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """Append-only on-disk store of embeddings keyed by (model name, text hash)."""
+
+    def __init__(self, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.path = os.path.join(cache_dir, f"{slug}.bin")
+        self.dim: Optional[int] = None
+        self._vectors: Dict[bytes, array] = {}
+        self._pending: List[bytes] = []
+        self._load()
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC) or len(data) < len(MAGIC) + HEADER.size:
+            print(f"Ignoring invalid embedding cache file {self.path}")
+            return
+        (self.dim,) = HEADER.unpack_from(data, len(MAGIC))
+        record_size = DIGEST_SIZE + 4 * self.dim
+        offset = len(MAGIC) + HEADER.size
+        # A trailing partial record (interrupted write) is ignored
+        while offset + record_size <= len(data):
+            digest = data[offset:offset + DIGEST_SIZE]
+            vector = array("f")
+            vector.frombytes(data[offset + DIGEST_SIZE:offset + record_size])
+            self._vectors[digest] = vector
+            offset += record_size
+
+    def get(self, text: str) -> Optional[List[float]]:
+        vector = self._vectors.get(text_digest(text))
+        return vector.tolist() if vector is not None else None
+
+    def put(self, text: str, vector: List[float]):
+        digest = text_digest(text)
+        if digest in self._vectors:
+            return
+        if self.dim is None:
+            self.dim = len(vector)
+        elif len(vector) != self.dim:
+            raise ValueError(f"Embedding dimension {len(vector)} does not match cache dimension {self.dim}")
+        self._vectors[digest] = array("f", vector)
+        self._pending.append(digest)
+
+    def flush(self):
+        """Append entries added since the last flush to the cache file."""
+        if not self._pending:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if not os.path.exists(self.path):
+            # Publish the header atomically: parallel shard builders may race to start the file
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(MAGIC + HEADER.pack(self.dim))
+            try:
+                os.link(tmp_path, self.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        records = b"".join(digest + self._vectors[digest].tobytes() for digest in self._pending)
+        # One unbuffered append per flush, so records from concurrent writers never interleave
+        with open(self.path, "ab", buffering=0) as f:
+            f.write(records)
+        self._pending = []
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model so document embeddings are served from an EmbeddingCache.
+
+    Only cache misses reach the underlying model, in batches of batch_size.
+    Query embeddings are passed straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.embed_seconds = 0.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        results: List[Optional[List[float]]] = [self.cache.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vec in zip(texts, results) if vec is None))
+        hit_count = sum(1 for vec in results if vec is not None)
+        self.hits += hit_count
+        self.misses += len(texts) - hit_count
+
+        computed: Dict[str, List[float]] = {}
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            for text, vector in zip(batch, self.embeddings.embed_documents(batch)):
+                self.cache.put(text, vector)
+                computed[text] = vector
+        self.cache.flush()
+
+        results = [vec if vec is not None else computed[text] for text, vec in zip(texts, results)]
+        self.embed_seconds += time.perf_counter() - start
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total else 0.0
+        throughput = total / self.embed_seconds if self.embed_seconds else 0.0
+        return (f"Embedding cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{total} chunks in {self.embed_seconds:.2f}s ({throughput:.1f} chunks/sec)")
+
+def build_embeddings(model_name: str = EMBEDDING_MODEL, batch_size: int = DEFAULT_BATCH_SIZE):
+    """The sentence-transformers embedder with an explicit encode batch size."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name, encode_kwargs={"batch_size": batch_size})
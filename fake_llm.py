@@ -0,0 +1,63 @@
+import re
+import time
+import asyncio
+from typing import List, Sequence
+from langchain_core.messages import AIMessageChunk
+
+SOURCE_RE = re.compile(r"Source: (\S+) \(Page ([^)]*)\)")
+
+class FakeStreamingLLM:
+    """Deterministic local stand-in for ChatGoogleGenerativeAI.
+
+    Streams a fixed-length answer citing the first retrieved source, after
+    `first_token_latency` seconds and at `tokens_per_second`. It implements
+    the subset of the chat model interface RAGHelper uses (stream, astream,
+    invoke, bind_tools), so benchmarks and batch runs need no API key.
+    """
+
+    def __init__(self, tokens_per_second: float = 50.0, first_token_latency: float = 0.3,
+                 answer_tokens: int = 60, tokens_per_chunk: int = 4):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.answer_tokens = answer_tokens
+        self.tokens_per_chunk = tokens_per_chunk
+
+    def bind_tools(self, tools: Sequence) -> "FakeStreamingLLM":
+        return self
+
+    def answer_for(self, messages: List) -> str:
+        context = " ".join(str(content) for role, content in messages if role == "system")
+        match = SOURCE_RE.search(context)
+        citation = f"[Source: {match.group(1)}, Page: {match.group(2)}]" if match else "[Source: none]"
+        query = str(messages[-1][1]) if messages else ""
+        words = f"This is a simulated answer to: {query}".split()
+        filler = ["lorem", "ipsum", "dolor", "sit", "amet"]
+        while len(words) < self.answer_tokens - 4:
+            words.append(filler[len(words) % len(filler)])
+        return " ".join(words[:self.answer_tokens - 4]) + f" {citation}"
+
+    def _pieces(self, messages: List) -> List[str]:
+        words = self.answer_for(messages).split(" ")
+        return [" ".join(words[i:i + self.tokens_per_chunk]) + " "
+                for i in range(0, len(words), self.tokens_per_chunk)]
+
+    def _chunk_delay(self) -> float:
+        return self.tokens_per_chunk / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def stream(self, messages: List):
+        time.sleep(self.first_token_latency)
+        for i, piece in enumerate(self._pieces(messages)):
+            if i:
+                time.sleep(self._chunk_delay())
+            yield AIMessageChunk(content=piece)
+
+    async def astream(self, messages: List):
+        await asyncio.sleep(self.first_token_latency)
+        for i, piece in enumerate(self._pieces(messages)):
+            if i:
+                await asyncio.sleep(self._chunk_delay())
+            yield AIMessageChunk(content=piece)
+
+    def invoke(self, messages: List) -> AIMessageChunk:
+        time.sleep(self.first_token_latency + self._chunk_delay() * (len(self._pieces(messages)) - 1))
+        return AIMessageChunk(content=self.answer_for(messages))
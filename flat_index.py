@@ -0,0 +1,228 @@
+import os
+import json
+import shutil
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+FLAT_INDEX_DIR = "flat_index"
+FLAT_INDEX_VERSION = 1
+# Rows scored per block; bounds the float32 temporary to BLOCK_ROWS x n_queries
+BLOCK_ROWS = 32768
+
+# Directory layout:
+#   header.json   {"version", "count", "dim", "dtype": "float16" | "int8"}
+#   vectors.bin   count x dim unit-normalized vectors (float16, or int8 with scales.bin)
+#   scales.bin    count x float32 per-row dequantization scales (int8 only)
+#   meta.jsonl    one {"id", "text", "metadata"} record per row
+#   meta.idx      (count + 1) x uint64 byte offsets into meta.jsonl
+#   id_hash.bin   count x uint64 sorted 64-bit hashes of the chunk IDs
+#   id_rows.bin   count x uint32 row of each id_hash.bin entry
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _id_hash(chunk_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+class FlatIndexWriter:
+    """Writes a flat index directory page by page, so the collection never has to fit in memory.
+
+    The directory replaces any existing index at path only when close() is called.
+    """
+
+    def __init__(self, path: str, dtype: str = "float16"):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported flat index dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.tmp_path = path + ".tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.count = 0
+        self.dim = 0
+        self.offsets = [0]
+        self.hashes: List[int] = []
+        self._vectors = open(os.path.join(self.tmp_path, "vectors.bin"), "wb")
+        self._scales = open(os.path.join(self.tmp_path, "scales.bin"), "wb") if dtype == "int8" else None
+        self._meta = open(os.path.join(self.tmp_path, "meta.jsonl"), "wb")
+
+    def add(self, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[Optional[Dict]],
+            embeddings: Sequence[Sequence[float]]):
+        if not len(ids):
+            return
+        matrix = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1))
+        self.dim = int(matrix.shape[1])
+        if self.dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._vectors.write(np.round(matrix / scales[:, None]).astype(np.int8).tobytes())
+            self._scales.write(scales.astype(np.float32).tobytes())
+        else:
+            self._vectors.write(matrix.astype(np.float16).tobytes())
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            line = (json.dumps({"id": chunk_id, "text": text, "metadata": metadata or {}}) + "\n").encode("utf-8")
+            self._meta.write(line)
+            self.offsets.append(self.offsets[-1] + len(line))
+            self.hashes.append(_id_hash(chunk_id))
+        self.count += len(ids)
+
+    def close(self):
+        for f in (self._vectors, self._scales, self._meta):
+            if f is not None:
+                f.close()
+        np.asarray(self.offsets, dtype=np.uint64).tofile(os.path.join(self.tmp_path, "meta.idx"))
+        # Sorted ID hashes let fetch-by-ID binary search the memory map instead of reading meta.jsonl
+        hashes = np.asarray(self.hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")
+        hashes[order].tofile(os.path.join(self.tmp_path, "id_hash.bin"))
+        order.astype(np.uint32).tofile(os.path.join(self.tmp_path, "id_rows.bin"))
+        with open(os.path.join(self.tmp_path, "header.json"), "w") as f:
+            json.dump({"version": FLAT_INDEX_VERSION, "count": self.count, "dim": self.dim, "dtype": self.dtype}, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+        print(f"Flat index written to {self.path}: {self.count} vectors ({self.dtype})")
+
+def write_flat_index(path: str, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[Optional[Dict]],
+                     embeddings: Sequence[Sequence[float]], dtype: str = "float16"):
+    """Write a flat index directory at path, replacing any existing one."""
+    writer = FlatIndexWriter(path, dtype)
+    writer.add(ids, texts, metadatas, embeddings)
+    writer.close()
+
+class FlatIndex:
+    """Read-only memory-mapped vector matrix with exact top-k by dot product.
+
+    Opening only reads the header and maps the files, so cold start is
+    near zero and the pages are shared between worker processes through the
+    OS page cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "header.json"), "r") as f:
+            header = json.load(f)
+        if header.get("version") != FLAT_INDEX_VERSION:
+            raise ValueError(f"Unsupported flat index version in {path}")
+        self.count = header["count"]
+        self.dim = header["dim"]
+        self.dtype = header["dtype"]
+        self.vectors = None
+        self.scales = None
+        if self.count:
+            self.vectors = np.memmap(os.path.join(path, "vectors.bin"), mode="r",
+                                     dtype=np.int8 if self.dtype == "int8" else np.float16,
+                                     shape=(self.count, self.dim))
+            if self.dtype == "int8":
+                self.scales = np.memmap(os.path.join(path, "scales.bin"), mode="r", dtype=np.float32,
+                                        shape=(self.count,))
+        self.offsets = np.memmap(os.path.join(path, "meta.idx"), mode="r", dtype=np.uint64, shape=(self.count + 1,))
+        self._meta = open(os.path.join(path, "meta.jsonl"), "rb")
+        self.id_hashes = None
+        self.id_rows = None
+        if self.count and os.path.exists(os.path.join(path, "id_hash.bin")):
+            self.id_hashes = np.memmap(os.path.join(path, "id_hash.bin"), mode="r", dtype=np.uint64, shape=(self.count,))
+            self.id_rows = np.memmap(os.path.join(path, "id_rows.bin"), mode="r", dtype=np.uint32, shape=(self.count,))
+        self._id_rows: Optional[Dict[str, int]] = None
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """Top-k (row, cosine score) per query row, scanning the matrix block by block."""
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        n_queries = queries.shape[0]
+        if not self.count or k <= 0:
+            return [[] for _ in range(n_queries)]
+        k = min(k, self.count)
+        best_rows = np.empty((n_queries, 0), dtype=np.int64)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+        for start in range(0, self.count, BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            if self.scales is not None:
+                scores *= self.scales[start:start + BLOCK_ROWS]
+            block_k = min(k, scores.shape[1])
+            top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return [list(zip(rows.tolist(), scores.tolist())) for rows, scores in zip(best_rows, best_scores)]
+
+    def record(self, row: int) -> Dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(os.pread(self._meta.fileno(), end - start, start))
+
+    def row_for_id(self, chunk_id: str) -> Optional[int]:
+        if self.id_hashes is not None:
+            target = np.uint64(_id_hash(chunk_id))
+            i = int(np.searchsorted(self.id_hashes, target))
+            # Hashes can collide, so the stored ID is checked
+            while i < self.count and self.id_hashes[i] == target:
+                row = int(self.id_rows[i])
+                if self.record(row)["id"] == chunk_id:
+                    return row
+                i += 1
+            return None
+        # Indexes written before id_hash.bin existed: build the map lazily on first fetch-by-ID
+        if self._id_rows is None:
+            self._id_rows = {self.record(row)["id"]: row for row in range(self.count)}
+        return self._id_rows.get(chunk_id)
+
+    def document(self, row: int) -> Document:
+        rec = self.record(row)
+        return Document(page_content=rec["text"], metadata=rec["metadata"], id=rec["id"])
+
+class FlatVectorStore(VectorStore):
+    """LangChain read-only VectorStore over a FlatIndex; written by data_ingestion."""
+
+    def __init__(self, path: str, embedding_function: Embeddings):
+        self.index = FlatIndex(path)
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("FlatVectorStore is read-only; re-run data_ingestion to rebuild it.")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        raise NotImplementedError("Use flat_index.write_flat_index to build a flat index.")
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        return [(self.index.document(row), score) for row, score in self.index.search_batch(np.asarray([embedding]), k)[0]]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def get(self, ids: List[str], include: Optional[List[str]] = None) -> Dict[str, List]:
+        """Chroma-style fetch by ID (documents and metadatas)."""
+        result = {"ids": [], "documents": [], "metadatas": []}
+        for chunk_id in ids:
+            row = self.index.row_for_id(chunk_id)
+            if row is None:
+                continue
+            rec = self.index.record(row)
+            result["ids"].append(rec["id"])
+            result["documents"].append(rec["text"])
+            result["metadatas"].append(rec["metadata"])
+        return result
@@ -0,0 +1,125 @@
+import os
+import re
+import math
+import threading
+from typing import Dict, List, Optional, Sequence
+from langchain_core.embeddings import Embeddings
+
+INTENT_ROUTING_ENABLED = os.environ.get("INTENT_ROUTING", "1") != "0"
+# A query goes to a non-documentation centroid only if it is this similar to it...
+INTENT_MIN_SIMILARITY = float(os.environ.get("INTENT_MIN_SIMILARITY", "0.6"))
+# ...and this much closer to it than to the documentation centroid
+INTENT_MARGIN = 0.1
+# Smoothing of the running retrieval latency used to estimate time saved
+RETRIEVAL_EWMA_ALPHA = 0.2
+
+DOCUMENTATION = "documentation"
+TICKET = "ticket"
+SMALL_TALK = "small_talk"
+
+# Questions ("What information is required to create a support ticket?") are
+# documentation, whatever they mention; only requests and greetings are routed
+QUESTION = re.compile(r"^\s*(what|how|why|when|where|which|who|whom|whose|can|could|do|does|did|is|are|was"
+                      r"|should|would|will|may|might)\b|\?\s*$", re.IGNORECASE)
+
+# High-precision patterns; anything ambiguous is left to the centroid check or to retrieval.
+# Contact questions are not routed: the company address only exists in the documents.
+INTENT_RULES = {
+    # Imperative or first-person ticket requests: "please open a ticket for me", "I want to file a support ticket"
+    TICKET: re.compile(r"^\s*(please\s+)?((i\s*)?(want|need|would like|'d like)\s+(you\s+)?to\s+)?(please\s+)?"
+                       r"(create|open|file|submit)\s+(me\s+)?(a|an)\s+(new\s+)?(support\s+)?ticket\b", re.IGNORECASE),
+    SMALL_TALK: re.compile(r"\s*(hi|hello|hey|thanks|thank you|thx|ok|okay|great|bye|goodbye)[\s!.,]*"
+                           r"(there|so much|a lot)?[\s!.]*", re.IGNORECASE),
+}
+# Rules that must match the whole message rather than part of it
+FULL_MATCH_RULES = {SMALL_TALK}
+
+INTENT_EXAMPLES = {
+    TICKET: [
+        "Please create a support ticket for me",
+        "I want to report a problem to your support team",
+        "Have someone from support follow up on my problem",
+        "Open a ticket, my account is broken",
+    ],
+    DOCUMENTATION: [
+        "What is the refund policy",
+        "How do I configure this feature",
+        "What does the documentation say about installation",
+        "Explain the terms for returning a product",
+        "Which page describes the borrowing rules",
+    ],
+}
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def _dot(a: Sequence[float], b: Sequence[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+class IntentRouter:
+    """Decides before retrieval whether a message needs the documents at all.
+
+    Ticket requests are handled by the create_support_ticket tool and
+    greetings need no sources, so those messages skip retrieval. Questions
+    always retrieve. route_text() applies the regex rules; route_vector()
+    compares the query embedding with per-intent centroids of
+    INTENT_EXAMPLES and only leaves "documentation" on a clear, confident match.
+    """
+
+    def __init__(self, embeddings: Embeddings, min_similarity: float = INTENT_MIN_SIMILARITY,
+                 margin: float = INTENT_MARGIN):
+        self.embeddings = embeddings
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self._centroids: Optional[Dict[str, List[float]]] = None
+        self._lock = threading.Lock()
+        self.retrieval_seconds: Optional[float] = None
+
+    def centroids(self) -> Dict[str, List[float]]:
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    centroids = {}
+                    for intent, examples in INTENT_EXAMPLES.items():
+                        vectors = [_normalize(v) for v in self.embeddings.embed_documents(examples)]
+                        centroids[intent] = _normalize([sum(column) / len(vectors) for column in zip(*vectors)])
+                    self._centroids = centroids
+        return self._centroids
+
+    def warm(self):
+        self.centroids()
+
+    @staticmethod
+    def is_question(query: str) -> bool:
+        return bool(QUESTION.search(query))
+
+    def route_text(self, query: str) -> Optional[Dict]:
+        """Intent decided by the rules alone (no embedding needed), or None."""
+        if self.is_question(query):
+            return {"intent": DOCUMENTATION, "method": "question", "score": None}
+        for intent, pattern in INTENT_RULES.items():
+            matched = pattern.fullmatch(query) if intent in FULL_MATCH_RULES else pattern.search(query)
+            if matched:
+                return {"intent": intent, "method": "rule", "score": None}
+        return None
+
+    def route_vector(self, query_vector: Sequence[float]) -> Dict:
+        """Nearest-centroid intent for non-questions; documentation unless another intent wins clearly."""
+        vector = _normalize(query_vector)
+        scores = {intent: _dot(vector, centroid) for intent, centroid in self.centroids().items()}
+        best = max(scores, key=scores.get)
+        if (best != DOCUMENTATION and scores[best] >= self.min_similarity
+                and scores[best] - scores[DOCUMENTATION] >= self.margin):
+            return {"intent": best, "method": "centroid", "score": round(scores[best], 4)}
+        return {"intent": DOCUMENTATION, "method": "centroid", "score": round(scores[DOCUMENTATION], 4)}
+
+    def record_retrieval(self, seconds: float):
+        """Feed the latency of a retrieval that did run; skipped ones are credited with its average."""
+        if self.retrieval_seconds is None:
+            self.retrieval_seconds = seconds
+        else:
+            self.retrieval_seconds += RETRIEVAL_EWMA_ALPHA * (seconds - self.retrieval_seconds)
+
+    def expected_savings(self) -> float:
+        return self.retrieval_seconds or 0.0
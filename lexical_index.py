@@ -0,0 +1,165 @@
+import os
+import re
+import math
+import mmap
+import struct
+import hashlib
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+LEXICAL_INDEX_FILE = "bm25_index.bin"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Terms found in more than this share of chunks (stopwords, "the", "python") add little
+# but cost the most postings; they are skipped when the query has any rarer term
+BM25_MAX_DF_RATIO = 0.5
+
+# File layout (little endian):
+#   header: MAGIC, n_docs, n_terms (uint32), avg_doc_len (float64)
+#   doc_lens:  n_docs x uint32
+#   id_offsets: (n_docs + 1) x uint64 into the id blob
+#   terms:     n_terms x (term_hash uint64, postings_offset uint64, df uint32), sorted by hash
+#   postings:  per term, df x (doc_index uint32, tf uint32)
+#   id blob:   utf-8 chunk IDs, concatenated
+MAGIC = b"BM25IDX1"
+HEADER = struct.Struct("<8sIId")
+TERM_ENTRY = struct.Struct("<QQI")
+POSTING = struct.Struct("<II")
+POSTING_DTYPE = np.dtype([("doc", "<u4"), ("tf", "<u4")])
+
+# Dotted identifiers such as decimal.Decimal are kept whole and also split into parts
+TOKEN_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*|\d+")
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in TOKEN_RE.findall(text.lower()):
+        tokens.append(match)
+        if "." in match:
+            tokens.extend(match.split("."))
+    return tokens
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+def build_lexical_index(chunks: Iterable[Tuple[str, str]], path: str):
+    """Write a BM25 index for (chunk_id, text) pairs to `path`."""
+    ids: List[str] = []
+    doc_lens: List[int] = []
+    postings: Dict[int, List[Tuple[int, int]]] = {}
+    for doc_index, (chunk_id, text) in enumerate(chunks):
+        tokens = tokenize(text)
+        ids.append(chunk_id)
+        doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term_hash(term), []).append((doc_index, tf))
+
+    n_docs = len(ids)
+    avg_doc_len = sum(doc_lens) / n_docs if n_docs else 0.0
+    id_blobs = [chunk_id.encode("utf-8") for chunk_id in ids]
+    id_offsets = [0]
+    for blob in id_blobs:
+        id_offsets.append(id_offsets[-1] + len(blob))
+
+    terms_start = HEADER.size + 4 * n_docs + 8 * (n_docs + 1)
+    postings_start = terms_start + TERM_ENTRY.size * len(postings)
+    term_table = []
+    offset = postings_start
+    for h in sorted(postings):
+        term_table.append(TERM_ENTRY.pack(h, offset, len(postings[h])))
+        offset += POSTING.size * len(postings[h])
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n_docs, len(postings), avg_doc_len))
+        f.write(struct.pack(f"<{n_docs}I", *doc_lens))
+        f.write(struct.pack(f"<{n_docs + 1}Q", *id_offsets))
+        f.write(b"".join(term_table))
+        for h in sorted(postings):
+            f.write(b"".join(POSTING.pack(d, tf) for d, tf in postings[h]))
+        f.write(b"".join(id_blobs))
+    os.replace(tmp_path, path)
+    print(f"Lexical index written to {path}: {n_docs} chunks, {len(postings)} terms")
+
+class LexicalIndex:
+    """Read-only BM25 index over a memory-mapped file.
+
+    Only the header is parsed on open; term lookups binary-search the mapped
+    term table, so startup cost and resident memory stay small.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_docs, self.n_terms, self.avg_doc_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a lexical index file")
+        self._doc_lens_start = HEADER.size
+        self._id_offsets_start = self._doc_lens_start + 4 * self.n_docs
+        self._terms_start = self._id_offsets_start + 8 * (self.n_docs + 1)
+        postings_end = self._terms_start + TERM_ENTRY.size * self.n_terms
+        if self.n_terms:
+            last_offset, last_df = TERM_ENTRY.unpack_from(self._mm, postings_end - TERM_ENTRY.size)[1:]
+            postings_end = last_offset + POSTING.size * last_df
+        self._ids_start = postings_end
+        self._doc_lens = np.frombuffer(self._mm, dtype="<u4", count=self.n_docs, offset=self._doc_lens_start)
+
+    def close(self):
+        # numpy views pin the mapping; drop them before closing it
+        self._doc_lens = None
+        self._mm.close()
+        self._file.close()
+
+    def _find_term(self, h: int):
+        lo, hi = 0, self.n_terms - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            mid_hash, offset, df = TERM_ENTRY.unpack_from(self._mm, self._terms_start + mid * TERM_ENTRY.size)
+            if mid_hash == h:
+                return offset, df
+            if mid_hash < h:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return None
+
+    def chunk_id(self, doc_index: int) -> str:
+        start, end = struct.unpack_from("<QQ", self._mm, self._id_offsets_start + 8 * doc_index)
+        return self._mm[self._ids_start + start:self._ids_start + end].decode("utf-8")
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, BM25 score) for the query."""
+        if not self.n_docs:
+            return []
+        found = [entry for entry in (self._find_term(term_hash(term)) for term in set(tokenize(query))) if entry]
+        max_df = BM25_MAX_DF_RATIO * self.n_docs
+        if any(df <= max_df for _, df in found):
+            found = [(offset, df) for offset, df in found if df <= max_df]
+        if not found:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        for offset, df in found:
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            postings = np.frombuffer(self._mm, dtype=POSTING_DTYPE, count=df, offset=offset)
+            docs = postings["doc"]
+            tf = postings["tf"].astype(np.float64)
+            norm = 1 - BM25_B + BM25_B * self._doc_lens[docs] / (self.avg_doc_len or 1.0)
+            # A term lists each chunk once, so the fancy-indexed add never collides
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            # Keep everything tied with the k-th score so ties still go to the lower chunk index
+            kth = np.partition(scores[matched], len(matched) - k)[len(matched) - k]
+            matched = matched[scores[matched] >= kth]
+        top = matched[np.lexsort((matched, -scores[matched]))][:k]
+        return [(self.chunk_id(int(doc_index)), float(scores[doc_index])) for doc_index in top]
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuse ranked ID lists; each list contributes 1 / (k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda item: -scores[item])
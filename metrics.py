@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+# Optional JSONL file receiving one record per traced request
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH")
+# When set, app.py serves /metrics (Prometheus text) and /metrics.json on this port
+METRICS_PORT = os.environ.get("METRICS_PORT")
+
+# Seconds; wide enough for both sub-millisecond index lookups and long generations
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+RATE_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+RECENT_SAMPLES = 2048
+
+class Histogram:
+    """Cumulative bucket counts for Prometheus plus a window of recent samples for percentiles."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+class MetricsRegistry:
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, buckets: List[float] = LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "histograms": {name: h.snapshot() for name, h in sorted(self._histograms.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def prometheus_text(self, prefix: str = "") -> str:
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {prefix}{name}_total counter")
+                lines.append(f"{prefix}{name}_total {value}")
+            for name, h in sorted(self._histograms.items()):
+                metric = f"{prefix}{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+                lines.append(f"{metric}_sum {h.sum}")
+                lines.append(f"{metric}_count {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+REGISTRY = MetricsRegistry()
+
+class RequestTrace:
+    """Stage timings for one request; recorded into REGISTRY as each stage ends."""
+
+    def __init__(self, kind: str, registry: MetricsRegistry = REGISTRY):
+        self.kind = kind
+        self.registry = registry
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.registry.observe(f"{self.kind}_{name}_seconds", seconds)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def finish(self, **fields):
+        """Record total time and append the trace to TRACE_LOG_PATH if configured."""
+        self.fields.update(fields)
+        total = self.elapsed()
+        self.registry.observe(f"{self.kind}_total_seconds", total)
+        self.registry.inc(f"{self.kind}_requests")
+        if TRACE_LOG_PATH:
+            record = {"kind": self.kind, "ts": self.started, "total": round(total, 6),
+                      "stages": {k: round(v, 6) for k, v in self.stages.items()}, **self.fields}
+            try:
+                with open(TRACE_LOG_PATH, "a") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+            except OSError as e:
+                print(f"Failed to write trace log: {e}")
+
+# Returns a dict with a "status" key; /health answers 200 only when it is "ready"
+_health_check: Optional[Callable[[], Dict]] = None
+
+def set_health_check(check: Optional[Callable[[], Dict]]):
+    global _health_check
+    _health_check = check
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 200
+        if self.path.startswith("/health"):
+            health = _health_check() if _health_check else {"status": "ready"}
+            body = json.dumps(health).encode("utf-8")
+            content_type = "application/json"
+            status = 200 if health.get("status") == "ready" else 503
+        elif self.path.startswith("/metrics.json"):
+            body = json.dumps(REGISTRY.snapshot(), indent=2).encode("utf-8")
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = REGISTRY.prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics, /metrics.json and /health")
+    return server
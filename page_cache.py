@@ -0,0 +1,98 @@
+import os
+import re
+import gzip
+import json
+from typing import Iterable, Iterator, List, Optional
+from langchain_core.documents import Document
+
+PAGE_CACHE_DIR = "page_cache"
+ENTRY_SUFFIX = ".jsonl.gz"
+
+# Entry layout: gzip-compressed JSONL, one {"text", "metadata"} record per
+# page in document order. Entries are immutable; a new file hash or loader
+# version simply produces a new entry.
+
+class PageCache:
+    """Parsed pages of source files keyed by (file name, content hash, loader version).
+
+    Re-ingesting an unchanged file (e.g. after a splitter or embedding model
+    change) reads its text back from here instead of parsing the PDF again.
+    Entries are streamed, so a file never has to be held in memory whole.
+    """
+
+    def __init__(self, loader_version: str, cache_dir: str = PAGE_CACHE_DIR):
+        self.loader_version = re.sub(r"[^A-Za-z0-9_.-]+", "_", loader_version)
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, path: str, content_hash: str) -> str:
+        name = os.path.basename(path)
+        return os.path.join(self.cache_dir, f"{name}.{content_hash[:16]}.{self.loader_version}{ENTRY_SUFFIX}")
+
+    def has(self, path: str, content_hash: str) -> bool:
+        return os.path.exists(self.entry_path(path, content_hash))
+
+    def iter_pages(self, path: str, content_hash: str) -> Iterator[Document]:
+        """Yield the cached pages of a file one at a time."""
+        with gzip.open(self.entry_path(path, content_hash), "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                yield Document(page_content=record["text"], metadata=record["metadata"])
+
+    def load(self, path: str, content_hash: str) -> Optional[List[Document]]:
+        """All cached pages of a file, or None on a miss or an unreadable entry."""
+        if not self.has(path, content_hash):
+            self.misses += 1
+            return None
+        try:
+            pages = list(self.iter_pages(path, content_hash))
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable page cache entry for {path}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pages
+
+    def store(self, path: str, content_hash: str, pages: Iterable[Document]):
+        """Write a file's pages; the entry only appears once it is complete."""
+        for _ in self.store_stream(path, content_hash, pages):
+            pass
+
+    def store_stream(self, path: str, content_hash: str, pages: Iterable[Document]) -> Iterator[Document]:
+        """Pass pages through while writing them to the cache.
+
+        The entry is published only after the last page went through; if the
+        stream fails or is abandoned part-way, nothing is cached.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = self.entry_path(path, content_hash)
+        tmp_path = f"{entry}.{os.getpid()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+                for page in pages:
+                    f.write(json.dumps({"text": page.page_content, "metadata": page.metadata}) + "\n")
+                    yield page
+            os.replace(tmp_path, entry)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def discard(self, path: str, content_hash: str):
+        entry = self.entry_path(path, content_hash)
+        if os.path.exists(entry):
+            os.remove(entry)
+
+    def prune(self, path: str, content_hash: str):
+        """Drop entries for older versions of this file or of the loader."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        pattern = re.compile(re.escape(os.path.basename(path)) + r"\.[0-9a-f]{16}\..+" + re.escape(ENTRY_SUFFIX))
+        keep = os.path.basename(self.entry_path(path, content_hash))
+        for name in os.listdir(self.cache_dir):
+            if name != keep and pattern.fullmatch(name):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        return f"Page cache: {self.hits}/{total} files served from {self.cache_dir}/ without parsing"
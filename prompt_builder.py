@@ -0,0 +1,159 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+# Most recent history messages kept verbatim (user + assistant each count as one)
+RECENT_HISTORY_MESSAGES = int(os.environ.get("RECENT_HISTORY_MESSAGES", "6"))
+# Share of the budget retrieved context cannot take from history
+HISTORY_RESERVE_TOKENS = 1000
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_LINE_CHARS = 200
+SUMMARY_CACHE_SIZE = 512
+
+_encoding = None
+_encoding_failed = False
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken's cl100k_base; falls back to ~4 chars per token if unavailable."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken unavailable, estimating tokens from length: {e}")
+            _encoding_failed = True
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+def message_text(msg: Dict) -> str:
+    content = msg.get("content", "")
+    return content if isinstance(content, str) else str(content)
+
+def summarize_message(msg: Dict) -> str:
+    """One short line per folded message: its first sentence, clipped."""
+    text = re.sub(r"\s+", " ", message_text(msg)).strip()
+    first = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS].rstrip() + "..."
+    speaker = "User" if msg.get("role") == "user" else "Assistant"
+    return f"- {speaker}: {first}"
+
+class PromptBuilder:
+    """Assembles chat messages within a token budget.
+
+    The system prompt and the query are always sent. Retrieved context is
+    truncated if needed, the most recent history messages are kept verbatim
+    while they fit, and older messages are folded into a rolling extractive
+    summary. Summaries are cached by the hash of the folded conversation
+    prefix, so each turn only summarizes the messages that just fell out of
+    the window.
+    """
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET, recent_messages: int = RECENT_HISTORY_MESSAGES):
+        self.budget = budget
+        self.recent_messages = recent_messages
+        self._summaries: "OrderedDict[str, Tuple[int, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prefix_keys(history: List[Dict]) -> List[str]:
+        """Rolling hash per prefix length: keys[n] identifies history[:n]."""
+        digest = hashlib.sha256()
+        keys = [digest.hexdigest()]
+        for msg in history:
+            digest.update(f"{msg.get('role')}\x00{message_text(msg)}\x01".encode("utf-8"))
+            keys.append(digest.hexdigest())
+        return keys
+
+    def summarize(self, history: List[Dict], keys: List[str]) -> List[str]:
+        """Summary lines for all of `history`, extending the longest cached prefix."""
+        with self._lock:
+            lines: List[str] = []
+            start = 0
+            for n in range(len(history), 0, -1):
+                cached = self._summaries.get(keys[n])
+                if cached is not None:
+                    self._summaries.move_to_end(keys[n])
+                    start, lines = n, list(cached[1])
+                    break
+            for msg in history[start:]:
+                lines.append(summarize_message(msg))
+            if history:
+                self._summaries[keys[len(history)]] = (len(history), lines)
+                while len(self._summaries) > SUMMARY_CACHE_SIZE:
+                    self._summaries.popitem(last=False)
+            return lines
+
+    def build(self, system_prompt: str, context_str: Optional[str], chat_history: List[Dict],
+              query: str) -> Tuple[List[Tuple[str, str]], Dict[str, int]]:
+        """Returns (messages, token stats)."""
+        stats = {"budget": self.budget, "system": count_tokens(system_prompt), "query": count_tokens(query)}
+        remaining = self.budget - stats["system"] - stats["query"]
+
+        context_msg = None
+        stats["context"] = 0
+        if context_str is not None:
+            reserve = min(HISTORY_RESERVE_TOKENS, remaining // 2) if chat_history else 0
+            context_msg = f"Context available:\n{truncate_to_tokens(context_str, remaining - reserve)}"
+            stats["context"] = count_tokens(context_msg)
+            remaining -= stats["context"]
+
+        # Keep the newest messages verbatim while they fit; fold the rest
+        recent: List[Dict] = []
+        history_tokens = 0
+        for msg in reversed(chat_history[-self.recent_messages:] if self.recent_messages else []):
+            tokens = count_tokens(message_text(msg))
+            if history_tokens + tokens > remaining:
+                break
+            recent.insert(0, msg)
+            history_tokens += tokens
+        folded = chat_history[:len(chat_history) - len(recent)]
+        remaining -= history_tokens
+
+        summary_msg = None
+        stats["summary"] = 0
+        if folded:
+            lines = self.summarize(folded, self._prefix_keys(folded))
+            header = "Summary of earlier conversation:"
+            limit = min(SUMMARY_MAX_TOKENS, remaining)
+            line_tokens = [count_tokens(line) + 1 for line in lines]
+            total = count_tokens(header) + sum(line_tokens)
+            # Oldest lines are dropped first when the summary is too long
+            first = 0
+            while first < len(lines) and total > limit:
+                total -= line_tokens[first]
+                first += 1
+            if first < len(lines):
+                summary_msg = "\n".join([header] + lines[first:])
+                stats["summary"] = count_tokens(summary_msg)
+
+        messages = [("system", system_prompt)]
+        if context_msg is not None:
+            messages.append(("system", context_msg))
+        if summary_msg is not None:
+            messages.append(("system", summary_msg))
+        for msg in recent:
+            role = "user" if msg["role"] == "user" else "assistant"
+            messages.append((role, msg["content"]))
+        messages.append(("user", query))
+
+        stats["history"] = history_tokens
+        stats["history_messages"] = len(recent)
+        stats["folded_messages"] = len(folded)
+        stats["total"] = stats["system"] + stats["context"] + stats["summary"] + stats["history"] + stats["query"]
+        return messages, stats
@@ -0,0 +1,126 @@
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from metrics import REGISTRY
+
+# Queries embedded together in one forward pass at most
+QUERY_EMBED_MAX_BATCH = int(os.environ.get("QUERY_EMBED_MAX_BATCH", "16"))
+# How long the first query of a batch waits for company; 0 only merges queries already queued
+QUERY_EMBED_MAX_WAIT_MS = float(os.environ.get("QUERY_EMBED_MAX_WAIT_MS", "5"))
+# Recent query vectors kept in memory (exact query text); 0 disables the cache
+QUERY_EMBED_CACHE_SIZE = int(os.environ.get("QUERY_EMBED_CACHE_SIZE", "1024"))
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+
+class _PendingQuery:
+    __slots__ = ("text", "enqueued", "done", "vector", "error")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.vector: Optional[List[float]] = None
+        self.error: Optional[BaseException] = None
+
+class QueryEmbedder:
+    """Merges concurrent query embeddings into small batches, with an LRU of recent vectors.
+
+    embed_query() blocks the calling thread while a background worker
+    collects up to max_batch queued queries (waiting at most max_wait_ms
+    after the first) and embeds them with one embed_documents call. The
+    sentence-transformers model encodes queries and documents the same way,
+    so the vectors are identical to embed_query's.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch: int = QUERY_EMBED_MAX_BATCH,
+                 max_wait_ms: float = QUERY_EMBED_MAX_WAIT_MS, cache_size: int = QUERY_EMBED_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[_PendingQuery]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def _cached(self, text: str) -> Optional[List[float]]:
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+            return vector
+
+    def _remember(self, text: str, vector: List[float]):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                    self._worker.start()
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._cached(text)
+        if vector is not None:
+            REGISTRY.inc("query_embedding_cache_hits")
+            return list(vector)
+        REGISTRY.inc("query_embedding_cache_misses")
+        pending = _PendingQuery(text)
+        self._ensure_worker()
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return list(pending.vector)
+
+    def _collect(self) -> List[_PendingQuery]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                # Whatever is already queued joins right away; beyond that wait until the deadline
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            for pending in batch:
+                REGISTRY.observe("query_embedding_queue_wait_seconds", start - pending.enqueued)
+            # Identical queries in one batch are embedded once
+            texts = list(dict.fromkeys(pending.text for pending in batch))
+            REGISTRY.observe("query_embedding_batch_size", len(texts), buckets=BATCH_SIZE_BUCKETS)
+            try:
+                vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+                for text, vector in vectors.items():
+                    self._remember(text, vector)
+                for pending in batch:
+                    pending.vector = vectors[pending.text]
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            REGISTRY.observe("query_embedding_batch_seconds", time.perf_counter() - start)
+            for pending in batch:
+                pending.done.set()
@@ -1,5 +1,12 @@
 import os
-from typing import List, Dict, Any, Optional
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
@@ -7,77 +14,359 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.tools import tool
+from langchain_core.documents import Document
 from dotenv import load_dotenv
-from github import Github
+from embedding_cache import EMBEDDING_MODEL
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from lexical_index import LEXICAL_INDEX_FILE, LexicalIndex, reciprocal_rank_fusion
+from flat_index import FLAT_INDEX_DIR
+from ticket_queue import get_ticket_dispatcher
+from prompt_builder import PromptBuilder, count_tokens
+from reranker import Reranker, RERANK_ENABLED, RERANK_CANDIDATES
+from query_embedder import QueryEmbedder
+from intent_router import IntentRouter, INTENT_ROUTING_ENABLED, DOCUMENTATION, TICKET
+from sharding import SCOPE_OVERFETCH, ShardedVectorStore, cosine_search, resolve_scope, shard_path
+from context_compression import CONTEXT_COMPRESSION_ENABLED, compress_context, load_page_furniture
+from metrics import REGISTRY, RATE_BUCKETS, RequestTrace
 
 load_dotenv()
 
 DB_PATH = "chroma_db_v4"
+# Rewritten by data_ingestion on every (re-)ingest; its mtime versions the index
+MANIFEST_FILE = "ingest_manifest.json"
 
-# Global fallback for environment variables
+# Retrieval settings
+RETRIEVAL_K = 3
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "1") != "0"
+# Candidates taken from each leg before reciprocal-rank fusion
+HYBRID_CANDIDATES = 10
+# "chroma" or "flat" (memory-mapped matrix written by data_ingestion --flat-index)
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma")
+
+# Startup defaults (Space secrets); sessions pass their own values explicitly
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 GITHUB_REPO = os.environ.get("GITHUB_REPO") # Format: "username/repo"
 
 # --- 1. Tool Definition ---
-@tool
-def create_support_ticket(user_name: str, user_email: str, issue_summary: str, issue_description: str) -> str:
-    """
-    Creates a support ticket on GitHub Issues.
-    Use this tool when the user explicitly asks to create a ticket OR when the answer cannot be found in the documentation.
+# How long a chat turn keeps streaming while waiting for the issue URL
+TICKET_WAIT_SECONDS = 15
+
+def queue_support_ticket(user_name: str, user_email: str, issue_summary: str, issue_description: str,
+                         github_token: Optional[str] = None, github_repo: Optional[str] = None) -> Tuple[Optional[str], str]:
+    """Queue a GitHub issue for background creation. Returns (ticket ref or None, message).
+
+    github_token/github_repo come from the caller's session and default to the startup values.
     """
-    token = os.environ.get("GITHUB_TOKEN")
-    repo_name = os.environ.get("GITHUB_REPO")
+    token = github_token or GITHUB_TOKEN
+    repo_name = github_repo or GITHUB_REPO
 
     if not token or not repo_name:
-        return f"Error: GitHub configuration missing. Required: GITHUB_TOKEN and GITHUB_REPO. (Current Repo: {repo_name})"
+        return None, f"Error: GitHub configuration missing. Required: GITHUB_TOKEN and GITHUB_REPO. (Current Repo: {repo_name})"
 
     # Clean repo name in case a full URL was pasted
     repo_name = repo_name.replace("https://github.com/", "").strip("/")
     
-    print(f"!!! CREATING TICKET in {repo_name} for {user_email} !!!")
+    print(f"!!! QUEUING TICKET in {repo_name} for {user_email} !!!")
+
+    # Create full description with user info
+    full_body = f"**User**: {user_name} ({user_email})\n\n**Description**:\n{issue_description}\n\n*Created via AI Agent*"
 
     try:
-        g = Github(token)
-        repo = g.get_repo(repo_name)
-        
-        # Create full description with user info
-        full_body = f"**User**: {user_name} ({user_email})\n\n**Description**:\n{issue_description}\n\n*Created via AI Agent*"
-        
-        issue = repo.create_issue(
-            title=issue_summary,
-            body=full_body,
-            labels=["support", "ai-generated"]
-        )
-        
-        return f"Success! GitHub Issue created: {issue.html_url} (Issue #{issue.number})"
+        ref = get_ticket_dispatcher().submit(token, repo_name, issue_summary, full_body, ["support", "ai-generated"])
     except Exception as e:
-        error_msg = str(e)
-        if "403" in error_msg:
-             return f"Failed to create GitHub issue: 403 Forbidden. This usually means your GITHUB_TOKEN is missing the 'repo' or 'issues' write scope. Please check your token settings."
-        return f"Failed to create GitHub issue: {error_msg}"
+        return None, f"Failed to queue GitHub issue: {e}"
+    return ref, f"Support ticket {ref} received and is being filed in {repo_name}."
 
-# --- 2. RAG Chain Setup ---
-class RAGHelper:
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
-        self.model_name = model_name
-        # Using Google Embeddings
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        if os.path.exists(DB_PATH):
-            self.vectorstore = Chroma(
-                persist_directory=DB_PATH, 
-                embedding_function=self.embeddings
-            )
+def describe_ticket(ref: str, info: Optional[Dict]) -> str:
+    if info is None:
+        return f"Ticket {ref} not found."
+    if info["status"] == "sent":
+        return f"Success! GitHub Issue created: {info['issue_url']} (Issue #{info['issue_number']}, ticket {ref})"
+    if info["status"] == "failed":
+        return f"Failed to create GitHub issue for ticket {ref}: {info['error']}"
+    return f"Ticket {ref} is still queued and will be created in the background (attempts so far: {info['attempts']})."
+
+@tool
+def create_support_ticket(user_name: str, user_email: str, issue_summary: str, issue_description: str) -> str:
+    """
+    Creates a support ticket on GitHub Issues.
+    Use this tool when the user explicitly asks to create a ticket OR when the answer cannot be found in the documentation.
+    """
+    return queue_support_ticket(user_name, user_email, issue_summary, issue_description)[1]
+
+# --- 2. Shared Retrieval Backend ---
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """The sentence-transformers model, loaded once per process."""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                _embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    return _embeddings
+
+_query_embedder: Optional[QueryEmbedder] = None
+_query_embedder_lock = threading.Lock()
+
+def get_query_embedder() -> QueryEmbedder:
+    """Shared micro-batching query embedder, so concurrent chats share forward passes."""
+    global _query_embedder
+    if _query_embedder is None:
+        embeddings = get_embeddings()
+        with _query_embedder_lock:
+            if _query_embedder is None:
+                _query_embedder = QueryEmbedder(embeddings)
+    return _query_embedder
+
+class RetrievalBackend:
+    """Embedder, vector store and retriever. Expensive to build, so one per process."""
+
+    def __init__(self, db_path: str = DB_PATH, backend: str = VECTOR_BACKEND):
+        self.db_path = db_path
+        self.embeddings = get_embeddings()
+        manifest = read_manifest(db_path)
+        self.sources = sorted(manifest.get("files", {})) if manifest else []
+        self.backend = backend
+        self.vectorstore = None
+        if manifest and manifest.get("sharding"):
+            # Files were spread over several stores; queries fan out (or are routed) across them
+            source_shards = {path: state["shard"] for path, state in manifest["files"].items()}
+            stores = {shard: self.open_store(shard_path(db_path, shard), backend)
+                      for shard in sorted(set(source_shards.values()))}
+            self.vectorstore = ShardedVectorStore(stores, source_shards, self.embeddings)
+            print(f"Opened {len(stores)} vector store shards ({manifest['sharding']['by']}).")
+        elif os.path.exists(db_path):
+            self.vectorstore = self.open_store(db_path, backend)
+        if self.vectorstore is not None:
             self.retriever = self.vectorstore.as_retriever(
                 search_type="similarity",
-                search_kwargs={"k": 3}
+                search_kwargs={"k": RETRIEVAL_K}
             )
         else:
-            self.vectorstore = None
             self.retriever = None
 
-        # model selection
-        self.llm = ChatGoogleGenerativeAI(model=self.model_name, temperature=0)
-        self.llm_with_tools = self.llm.bind_tools([create_support_ticket])
+        self.lexical_index = None
+        lexical_path = os.path.join(db_path, LEXICAL_INDEX_FILE)
+        if HYBRID_RETRIEVAL and self.vectorstore is not None and os.path.exists(lexical_path):
+            try:
+                self.lexical_index = LexicalIndex(lexical_path)
+            except Exception as e:
+                print(f"Lexical index unavailable, using vector search only: {e}")
+        # Per-source header/footer lines detected at ingestion, stripped from prompt context
+        self.page_furniture = load_page_furniture(manifest)
+        # Runs the vector and lexical legs of a hybrid query side by side
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+    def open_store(self, path: str, backend: str):
+        """Chroma store at path, or its flat index copy for the "flat" backend when one exists."""
+        flat_path = os.path.join(path, FLAT_INDEX_DIR)
+        if backend == "flat":
+            if os.path.exists(flat_path):
+                from flat_index import FlatVectorStore
+                return FlatVectorStore(flat_path, self.embeddings)
+            print(f"Flat index not found at {flat_path}. Falling back to Chroma.")
+        return Chroma(persist_directory=path, embedding_function=self.embeddings)
+
+    def vector_search_with_scores(self, query: str, query_vector: Optional[List[float]] = None,
+                                  k: int = RETRIEVAL_K, sources: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """(document, cosine similarity) pairs, best first, optionally limited to some source files."""
+        if query_vector is None:
+            query_vector = self.embeddings.embed_query(query)
+        if isinstance(self.vectorstore, ShardedVectorStore):
+            return self.vectorstore.similarity_search_by_vector_with_score(query_vector, k=k, sources=sources)
+        return cosine_search(self.vectorstore, query_vector, k, sources)
+
+    def vector_search(self, query: str, query_vector: Optional[List[float]] = None, k: int = RETRIEVAL_K):
+        return [doc for doc, _ in self.vector_search_with_scores(query, query_vector, k)]
+
+    def search_with_scores(self, query: str, query_vector: Optional[List[float]] = None, k: int = RETRIEVAL_K,
+                           scope: Optional[List[str]] = None) -> List[Tuple[Document, Optional[float]]]:
+        """Top-k (document, vector similarity) pairs; lexical-only hits of a hybrid query have no vector score.
+
+        scope names documents (file name or stem) to search; on a sharded store only their shards are queried.
+        """
+        sources = resolve_scope(scope, self.sources)
+        if self.lexical_index is None:
+            return self.vector_search_with_scores(query, query_vector, k, sources)
+
+        candidates = max(k, HYBRID_CANDIDATES)
+        vector_future = self.executor.submit(self.vector_search_with_scores, query, query_vector, candidates, sources)
+        # The BM25 index is global, so scoped queries over-fetch and keep chunks of the scoped files
+        lexical_k = candidates * SCOPE_OVERFETCH if sources else candidates
+        lexical_future = self.executor.submit(self.lexical_index.search, query, lexical_k)
+        vector_pairs = vector_future.result()
+        lexical_ids = [chunk_id for chunk_id, _ in lexical_future.result()]
+        if sources:
+            allowed = {os.path.basename(path) for path in sources}
+            lexical_ids = [chunk_id for chunk_id in lexical_ids if chunk_id.split(":", 1)[0] in allowed][:candidates]
+
+        docs_by_id = {}
+        vector_scores = {}
+        for doc, score in vector_pairs:
+            doc_id = doc.id or doc.page_content
+            docs_by_id[doc_id] = doc
+            vector_scores[doc_id] = score
+        fused_ids = reciprocal_rank_fusion([list(docs_by_id), lexical_ids])[:k]
+
+        # Lexical-only hits are fetched from the store by ID
+        missing = [doc_id for doc_id in fused_ids if doc_id not in docs_by_id]
+        if missing:
+            fetched = self.vectorstore.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, text, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                docs_by_id[doc_id] = Document(page_content=text, metadata=metadata or {}, id=doc_id)
+        return [(docs_by_id[doc_id], vector_scores.get(doc_id)) for doc_id in fused_ids if doc_id in docs_by_id]
+
+    def search(self, query: str, query_vector: Optional[List[float]] = None, k: int = RETRIEVAL_K,
+               scope: Optional[List[str]] = None):
+        """Top-k documents; BM25 and vector results are fused with RRF when a lexical index exists."""
+        return [doc for doc, _ in self.search_with_scores(query, query_vector, k, scope)]
+
+_retrieval_backends: Dict[str, RetrievalBackend] = {}
+_retrieval_lock = threading.Lock()
+
+def get_retrieval_backend(backend: Optional[str] = None) -> RetrievalBackend:
+    """Process-wide RetrievalBackend per vector backend, created on first use."""
+    backend = backend or VECTOR_BACKEND
+    if backend not in _retrieval_backends:
+        with _retrieval_lock:
+            if backend not in _retrieval_backends:
+                _retrieval_backends[backend] = RetrievalBackend(backend=backend)
+    return _retrieval_backends[backend]
+
+def reset_retrieval_backend():
+    """Drop the shared backends so the next use reopens the stores (e.g. after re-ingestion)."""
+    with _retrieval_lock:
+        _retrieval_backends.clear()
+    _answer_cache.clear()
+
+def read_manifest(db_path: str = DB_PATH) -> Optional[Dict]:
+    """The ingestion manifest (file states, shard layout), or None if missing or unreadable."""
+    try:
+        with open(os.path.join(db_path, MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def index_version(db_path: str = DB_PATH) -> Optional[float]:
+    try:
+        return os.path.getmtime(os.path.join(db_path, MANIFEST_FILE))
+    except OSError:
+        return None
+
+# Shared by all helpers; entries are keyed by model name
+_answer_cache = AnswerCache()
+
+def get_answer_cache() -> AnswerCache:
+    return _answer_cache
+
+_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> Optional[Reranker]:
+    """Shared cross-encoder reranker, or None when RERANK=0."""
+    global _reranker
+    if not RERANK_ENABLED:
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = Reranker()
+    return _reranker
+
+_intent_router: Optional[IntentRouter] = None
+_intent_router_lock = threading.Lock()
+
+def get_intent_router() -> Optional[IntentRouter]:
+    """Shared pre-retrieval intent router, or None when INTENT_ROUTING=0."""
+    global _intent_router
+    if not INTENT_ROUTING_ENABLED:
+        return None
+    if _intent_router is None:
+        embeddings = get_embeddings()
+        with _intent_router_lock:
+            if _intent_router is None:
+                _intent_router = IntentRouter(embeddings)
+    return _intent_router
+
+# --- 3. Pooled LLM Clients ---
+# One client per (model, API key); bounded so per-user keys can't grow it without limit
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "8"))
+_llm_pool: "OrderedDict[Tuple[str, str], Tuple[Any, Any]]" = OrderedDict()
+_llm_pool_lock = threading.Lock()
+
+def get_llm(model_name: str, google_api_key: Optional[str] = None):
+    """Return (llm, llm_with_tools) for a model/key pair from a small LRU pool."""
+    key_id = hashlib.sha256(google_api_key.encode()).hexdigest() if google_api_key else ""
+    pool_key = (model_name, key_id)
+    with _llm_pool_lock:
+        if pool_key in _llm_pool:
+            _llm_pool.move_to_end(pool_key)
+            return _llm_pool[pool_key]
+
+    kwargs = {"google_api_key": google_api_key} if google_api_key else {}
+    llm = ChatGoogleGenerativeAI(model=model_name, temperature=0, **kwargs)
+    clients = (llm, llm.bind_tools([create_support_ticket]))
+
+    with _llm_pool_lock:
+        _llm_pool[pool_key] = clients
+        _llm_pool.move_to_end(pool_key)
+        while len(_llm_pool) > LLM_POOL_SIZE:
+            _llm_pool.popitem(last=False)
+    return clients
+
+# Shared so rolling history summaries are reused across helpers
+_prompt_builder = PromptBuilder()
+
+def get_prompt_builder() -> PromptBuilder:
+    return _prompt_builder
+
+# Cap on concurrent streaming LLM calls in the async path
+LLM_MAX_INFLIGHT = int(os.environ.get("LLM_MAX_INFLIGHT", "16"))
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+_llm_semaphore_loop = None
+
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """Semaphore limiting in-flight LLM calls, bound to the running event loop."""
+    global _llm_semaphore, _llm_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _llm_semaphore is None or _llm_semaphore_loop is not loop:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_INFLIGHT)
+        _llm_semaphore_loop = loop
+    return _llm_semaphore
+
+# --- 4. RAG Chain Setup ---
+class RAGHelper:
+    def __init__(self, model_name: str = "gemini-2.5-flash", google_api_key: Optional[str] = None,
+                 retrieval: Optional[RetrievalBackend] = None, use_answer_cache: bool = ANSWER_CACHE_ENABLED,
+                 llm: Optional[Any] = None, vector_backend: Optional[str] = None,
+                 use_reranker: bool = RERANK_ENABLED, use_context_compression: bool = CONTEXT_COMPRESSION_ENABLED,
+                 github_token: Optional[str] = None, github_repo: Optional[str] = None, execute_tools: bool = True,
+                 use_intent_router: bool = INTENT_ROUTING_ENABLED):
+        self.model_name = model_name
+        # Per-session ticket credentials; None falls back to the startup secrets
+        self.github_token = github_token
+        self.github_repo = github_repo
+        # Batch runs record tool calls instead of filing real tickets
+        self.execute_tools = execute_tools
+        self.answer_cache = get_answer_cache() if use_answer_cache else None
+        # Retrieval is shared across helpers; only the LLM client depends on model/key
+        self.retrieval = retrieval or get_retrieval_backend(vector_backend)
+        self.embeddings = self.retrieval.embeddings
+        self.query_embedder = get_query_embedder()
+        self.vectorstore = self.retrieval.vectorstore
+        self.retriever = self.retrieval.retriever
+        self.reranker = get_reranker() if use_reranker else None
+        self.use_context_compression = use_context_compression
+        self.intent_router = get_intent_router() if use_intent_router else None
+
+        # model selection (an explicit llm, e.g. fake_llm.FakeStreamingLLM, bypasses the pool)
+        if llm is not None:
+            self.llm, self.llm_with_tools = llm, llm.bind_tools([create_support_ticket])
+        else:
+            self.llm, self.llm_with_tools = get_llm(self.model_name, google_api_key)
+        self.prompt_builder = get_prompt_builder()
 
         # System prompt with Company Info and Citation instructions
         self.system_prompt = """You are a helpful customer support assistant for TechSolutions Inc. 
@@ -94,6 +383,7 @@ class RAGHelper:
            - Use "User" or "Valued Customer" as the name if not provided.
            - Use the provided summary as the description if the description is missing.
            - Do NOT ask follow-up questions if you have enough to reasonably create a ticket. Just call the create_support_ticket tool immediately.
+        5. Greetings and thanks need no sources.
         """
 
     def format_docs(self, docs):
@@ -106,61 +396,315 @@ class RAGHelper:
             formatted.append(f"Content: {content}\nSource: {source} (Page {page})")
         return "\n\n".join(formatted)
 
-    def get_response_stream(self, query: str, chat_history: List[Dict] = []):
+    @staticmethod
+    def stream_text(text: str, chunk_size: int = 32):
+        """Replay a finished answer in small pieces so cached answers still stream."""
+        for i in range(0, len(text), chunk_size):
+            yield text[i:i + chunk_size]
+
+    def prepare_request(self, query: str, chat_history: List[Dict], trace: Optional[RequestTrace] = None,
+                        scope: Optional[List[str]] = None, query_vector: Optional[List[float]] = None) -> Dict[str, Any]:
         """
-        Generates a response using RAG and Tool Calling.
+        Blocking pre-LLM work: intent routing, answer cache lookup, retrieval and message assembly.
+        Returns a request dict; if "reply" is set it is streamed as-is and no LLM call is made.
+        scope optionally limits retrieval to some documents (file names or stems).
+        query_vector skips the embedding step when the caller embedded the query already (e.g. in a batch).
         """
+        trace = trace or RequestTrace("rag")
+        request = {"query": query, "reply": None, "messages": None, "cache": None, "query_vector": query_vector,
+                   "prompt_stats": None, "rerank": None, "compression": None, "sources": [], "intent": None,
+                   "trace": trace, "outcome": "llm"}
         if not self.retriever:
-            yield "System Error: Knowledge base not loaded. Please ensure data is ingested."
-            return
+            request["reply"] = "System Error: Knowledge base not loaded. Please ensure data is ingested."
+            request["outcome"] = "error"
+            return request
+
+        # Answers depend on the conversation and the scope, so only stateless, unscoped turns are cached
+        cache = self.answer_cache if not chat_history and not scope else None
+        # Ticket requests and greetings don't need the documents; clear cases are caught before embedding
+        route = self.intent_router.route_text(query) if self.intent_router is not None else None
+        if route is not None and route["intent"] == TICKET:
+            # Ticket turns call a tool with side effects, so they are never served from the cache
+            cache = None
+        request["cache"] = cache
 
         # 1. Retrieve Context
         try:
-            docs = self.retriever.invoke(query)
-            context_str = self.format_docs(docs)
+            # Embed once and reuse the vector for routing, the semantic cache lookup and the search
+            needs_vector = route is None or route["intent"] == DOCUMENTATION or cache is not None
+            if request["query_vector"] is None and needs_vector:
+                with trace.stage("embedding"):
+                    request["query_vector"] = self.query_embedder.embed_query(query)
+            if route is None and self.intent_router is not None:
+                with trace.stage("intent"):
+                    route = self.route_by_embedding(request["query_vector"])
+                if route["intent"] == TICKET:
+                    cache = request["cache"] = None
+            request["intent"] = route
+            if cache is not None:
+                with trace.stage("answer_cache"):
+                    cache.check_index_version(index_version(self.retrieval.db_path))
+                    cached_answer = cache.lookup(self.model_name, query, request["query_vector"])
+                if cached_answer is not None:
+                    print(f"Answer cache hit ({cache.stats()})")
+                    request["reply"] = cached_answer
+                    request["outcome"] = "cache_hit"
+                    return request
+            if route is not None and route["intent"] != DOCUMENTATION:
+                # No context block at all: the system prompt and the ticket tool cover these turns
+                context_str = None
+                self.log_route(route, trace, skipped=True)
+            else:
+                start = time.perf_counter()
+                context_str = self.retrieve_context(query, request, scope)
+                if self.intent_router is not None:
+                    self.intent_router.record_retrieval(time.perf_counter() - start)
+                    self.log_route(route, trace, skipped=False)
         except Exception as e:
-            yield f"Retrieval Error: {e}"
+            request["reply"] = f"Retrieval Error: {e}"
+            request["outcome"] = "error"
+            return request
+
+        # 2. Construct Messages within the token budget (older history is summarized)
+        with trace.stage("prompt_assembly"):
+            messages, prompt_stats = self.prompt_builder.build(self.system_prompt, context_str, chat_history, query)
+        print(f"Prompt tokens: {prompt_stats}")
+        request["messages"] = messages
+        request["prompt_stats"] = prompt_stats
+        return request
+
+    def retrieve_context(self, query: str, request: Dict[str, Any], scope: Optional[List[str]] = None) -> str:
+        """Search (and rerank/compress) for the query and return the formatted context block."""
+        trace = request["trace"]
+        if self.reranker is None:
+            with trace.stage("vector_search"):
+                docs = self.retrieval.search(query, request["query_vector"], scope=scope)
+        else:
+            # Over-fetch, then keep only the chunks the cross-encoder finds relevant
+            with trace.stage("vector_search"):
+                candidates = self.retrieval.search_with_scores(query, request["query_vector"], k=RERANK_CANDIDATES,
+                                                               scope=scope)
+            with trace.stage("rerank"):
+                docs = self.rerank(query, candidates, request)
+        request["sources"] = [{"source": doc.metadata.get("source"), "page": doc.metadata.get("page")} for doc in docs]
+        if self.use_context_compression:
+            with trace.stage("context_compression"):
+                return self.compressed_context(docs, request)
+        return self.format_docs(docs)
+
+    def route_by_embedding(self, query_vector: List[float]) -> Dict[str, Any]:
+        try:
+            return self.intent_router.route_vector(query_vector)
+        except Exception as e:
+            # Routing is only an optimization; when in doubt, retrieve
+            print(f"Intent routing failed, retrieving: {e}")
+            return {"intent": DOCUMENTATION, "method": "fallback", "score": None}
+
+    def log_route(self, route: Dict[str, Any], trace: RequestTrace, skipped: bool):
+        trace.fields["intent"] = route["intent"]
+        REGISTRY.inc(f"intent_{route['intent']}")
+        score = f", score {route['score']}" if route["score"] is not None else ""
+        if not skipped:
+            print(f"Intent: {route['intent']} ({route['method']}{score}), retrieving")
             return
+        saved = self.intent_router.expected_savings()
+        REGISTRY.observe("intent_retrieval_seconds_saved", saved)
+        print(f"Intent: {route['intent']} ({route['method']}{score}), retrieval skipped (~{saved * 1000:.0f} ms saved)")
 
-        # 2. Construct Messages
-        messages = [
-            ("system", self.system_prompt),
-            ("system", f"Context available:\n{context_str}"),
-        ]
-        
-        # Add history
-        for msg in chat_history:
-            role = "user" if msg["role"] == "user" else "assistant"
-            messages.append((role, msg["content"]))
-            
-        messages.append(("user", query))
-
-        # 3. Call LLM (with tools)
+    def rerank(self, query: str, candidates: List[Tuple[Document, Optional[float]]], request: Dict[str, Any]) -> List[Document]:
         try:
-            response_stream = self.llm_with_tools.stream(messages)
-            
-            # Buffer for tool calls
-            final_tool_calls = []
-            
-            for chunk in response_stream:
-                if chunk.tool_calls:
-                     final_tool_calls.extend(chunk.tool_calls)
+            docs, stats = self.reranker.rerank(query, candidates, RETRIEVAL_K)
+        except Exception as e:
+            # A missing or broken cross-encoder must not take retrieval down with it
+            print(f"Rerank failed, using retrieval order: {e}")
+            return [doc for doc, _ in candidates[:RETRIEVAL_K]]
+        REGISTRY.inc("rerank_skipped" if stats["skipped"] else "rerank_applied")
+        REGISTRY.observe("rerank_chunks_kept", stats["kept"], buckets=[0, 1, 2, 3, 5, 8])
+        request["rerank"] = stats
+        print(f"Rerank: {stats}")
+        return docs
+
+    def compressed_context(self, docs: List[Document], request: Dict[str, Any]) -> str:
+        """format_docs over merged, de-duplicated chunks without page headers/footers."""
+        original = self.format_docs(docs)
+        compressed_docs, stats = compress_context(docs, self.retrieval.page_furniture)
+        context_str = self.format_docs(compressed_docs)
+        stats["tokens_before"] = count_tokens(original)
+        stats["tokens_after"] = count_tokens(context_str)
+        stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+        REGISTRY.observe("rag_context_tokens_saved", stats["tokens_saved"], buckets=RATE_BUCKETS)
+        request["compression"] = stats
+        print(f"Context compression: {stats}")
+        return context_str
+
+    @staticmethod
+    def chunk_text(chunk) -> str:
+        if isinstance(chunk.content, list):
+            # Join text parts if it's a list (common in some complex LLM outputs)
+            return "".join([c.get("text", str(c)) if isinstance(c, dict) else str(c) for c in chunk.content])
+        return str(chunk.content)
+
+    def record_generation(self, request: Dict[str, Any], llm_start: float, first_token_at: Optional[float],
+                          answer_parts: List[str]):
+        trace = request["trace"]
+        generation = time.perf_counter() - llm_start
+        trace.record("generation", generation)
+        if first_token_at is not None:
+            trace.record("time_to_first_token", first_token_at - llm_start)
+        output_tokens = count_tokens("".join(answer_parts))
+        trace.fields["output_tokens"] = output_tokens
+        if output_tokens and generation > 0:
+            REGISTRY.observe("rag_output_tokens_per_second", output_tokens / generation, RATE_BUCKETS)
+
+    def finish_request(self, request: Dict[str, Any], answer_parts: List[str], tool_calls: List[Dict]):
+        # Tool calls have side effects, so those answers are never replayed
+        cache = request["cache"]
+        if cache is not None and not tool_calls and answer_parts:
+            cache.store(self.model_name, request["query"], "".join(answer_parts), request["query_vector"])
+
+    def close_trace(self, request: Dict[str, Any]):
+        stats = request["prompt_stats"] or {}
+        request["trace"].finish(model=self.model_name, outcome=request["outcome"],
+                                prompt_tokens=stats.get("total"))
+        REGISTRY.inc(f"rag_outcome_{request['outcome']}")
+
+    def run_tool_call(self, tool_call: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """Execute a tool call. Returns (text to stream, ticket ref to follow up on)."""
+        if not self.execute_tools:
+            return f"\n\n[System]: Tool call {tool_call['name']}({tool_call['args']}) not executed (tools disabled).", None
+        if tool_call['name'] == 'create_support_ticket':
+            ref, tool_result = queue_support_ticket(**tool_call['args'], github_token=self.github_token,
+                                                    github_repo=self.github_repo)
+            return f"\n\n[System]: {tool_result}", ref
+        return None, None
+
+    def get_response_stream(self, query: str, chat_history: List[Dict] = [], scope: Optional[List[str]] = None):
+        """
+        Generates a response using RAG and Tool Calling.
+        """
+        request = self.prepare_request(query, chat_history, scope=scope)
+        trace = request["trace"]
+        try:
+            if request["reply"] is not None:
+                yield from self.stream_text(request["reply"])
+                return
+
+            # 3. Call LLM (with tools)
+            try:
+                llm_start = time.perf_counter()
+                first_token_at = None
+                response_stream = self.llm_with_tools.stream(request["messages"])
+                
+                # Buffer for tool calls
+                final_tool_calls = []
+                answer_parts = []
                 
-                if chunk.content:
-                    if isinstance(chunk.content, list):
-                        # Join text parts if it's a list (common in some complex LLM outputs)
-                        content_str = "".join([c.get("text", str(c)) if isinstance(c, dict) else str(c) for c in chunk.content])
+                for chunk in response_stream:
+                    if chunk.tool_calls:
+                         final_tool_calls.extend(chunk.tool_calls)
+                    
+                    if chunk.content:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        content_str = self.chunk_text(chunk)
+                        answer_parts.append(content_str)
                         yield content_str
-                    else:
-                        yield str(chunk.content)
-
-            # 4. Handle Tool Execution
-            if final_tool_calls:
-                 for tool_call in final_tool_calls:
-                     if tool_call['name'] == 'create_support_ticket':
-                         args = tool_call['args']
-                         # Execute tool
-                         tool_result = create_support_ticket.invoke(args)
-                         yield f"\n\n[System]: {tool_result}"
-        except Exception as e:
-            yield f"LLM Error: {e}"
+
+                self.record_generation(request, llm_start, first_token_at, answer_parts)
+                self.finish_request(request, answer_parts, final_tool_calls)
+
+                # 4. Handle Tool Execution
+                for tool_call in final_tool_calls:
+                    with trace.stage("tool_execution"):
+                        tool_output, ticket_ref = self.run_tool_call(tool_call)
+                    if tool_output:
+                        yield tool_output
+                    # The reference is already shown; keep streaming until the issue exists
+                    if ticket_ref:
+                        with trace.stage("ticket_wait"):
+                            info = get_ticket_dispatcher().wait(ticket_ref, TICKET_WAIT_SECONDS)
+                        yield f"\n\n[System]: {describe_ticket(ticket_ref, info)}"
+            except Exception as e:
+                request["outcome"] = "error"
+                yield f"LLM Error: {e}"
+        finally:
+            self.close_trace(request)
+
+    async def await_ticket(self, ref: str, timeout: float = TICKET_WAIT_SECONDS, poll_interval: float = 0.25):
+        """Poll the outbox without holding a thread until the ticket leaves 'pending'."""
+        dispatcher = get_ticket_dispatcher()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            info = dispatcher.status(ref)
+            if info is None or info["status"] != "pending" or asyncio.get_running_loop().time() >= deadline:
+                return info
+            await asyncio.sleep(poll_interval)
+
+    async def aget_response_stream(self, query: str, chat_history: List[Dict] = [], scope: Optional[List[str]] = None,
+                                   query_vector: Optional[List[float]] = None):
+        """
+        Async counterpart of get_response_stream.
+        Retrieval and tools run in the default executor; the LLM is streamed with astream
+        while holding a slot of the in-flight LLM call limit.
+        """
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(None, self.prepare_request, query, chat_history, None, scope, query_vector)
+        async for piece in self.astream_request(request):
+            yield piece
+
+    async def aanswer(self, query: str, chat_history: List[Dict] = [], scope: Optional[List[str]] = None,
+                      query_vector: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Non-streaming async answer with the finished request's sources, outcome and stage timings."""
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(None, self.prepare_request, query, chat_history, None, scope, query_vector)
+        parts = [piece async for piece in self.astream_request(request)]
+        trace = request["trace"]
+        return {"answer": "".join(parts), "sources": request["sources"], "outcome": request["outcome"],
+                "intent": (request["intent"] or {}).get("intent"),
+                "prompt_tokens": (request["prompt_stats"] or {}).get("total"),
+                "output_tokens": trace.fields.get("output_tokens"),
+                "stages": {name: round(seconds, 6) for name, seconds in trace.stages.items()}}
+
+    async def astream_request(self, request: Dict[str, Any]):
+        """Stream the answer for a request from prepare_request, then close its trace."""
+        loop = asyncio.get_running_loop()
+        trace = request["trace"]
+        try:
+            if request["reply"] is not None:
+                for piece in self.stream_text(request["reply"]):
+                    yield piece
+                return
+
+            try:
+                final_tool_calls = []
+                answer_parts = []
+                async with get_llm_semaphore():
+                    llm_start = time.perf_counter()
+                    first_token_at = None
+                    async for chunk in self.llm_with_tools.astream(request["messages"]):
+                        if chunk.tool_calls:
+                            final_tool_calls.extend(chunk.tool_calls)
+                        if chunk.content:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            content_str = self.chunk_text(chunk)
+                            answer_parts.append(content_str)
+                            yield content_str
+
+                self.record_generation(request, llm_start, first_token_at, answer_parts)
+                self.finish_request(request, answer_parts, final_tool_calls)
+
+                for tool_call in final_tool_calls:
+                    with trace.stage("tool_execution"):
+                        tool_output, ticket_ref = await loop.run_in_executor(None, self.run_tool_call, tool_call)
+                    if tool_output:
+                        yield tool_output
+                    if ticket_ref:
+                        with trace.stage("ticket_wait"):
+                            info = await self.await_ticket(ticket_ref)
+                        yield f"\n\n[System]: {describe_ticket(ticket_ref, info)}"
+            except Exception as e:
+                request["outcome"] = "error"
+                yield f"LLM Error: {e}"
+        finally:
+            self.close_trace(request)
@@ -0,0 +1,157 @@
+import os
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from answer_cache import normalize_query
+
+RERANK_ENABLED = os.environ.get("RERANK", "1") != "0"
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates over-fetched from retrieval and offered to the cross-encoder
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "12"))
+RERANK_BATCH_SIZE = 8
+# Scoring stops after this many milliseconds; unscored candidates keep their retrieval order
+RERANK_TIME_BUDGET_MS = float(os.environ.get("RERANK_TIME_BUDGET_MS", "200"))
+# Minimum cross-encoder relevance (sigmoid of the logit) for a chunk to reach the prompt
+RERANK_MIN_RELEVANCE = float(os.environ.get("RERANK_MIN_RELEVANCE", "0.2"))
+# A top vector hit at least this similar, and this far ahead of the runner-up, skips the cross-encoder
+RERANK_SKIP_MIN_SCORE = 0.55
+RERANK_SKIP_MARGIN = 0.12
+RERANK_CACHE_SIZE = 4096
+
+def _sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-x)) if x >= 0 else math.exp(x) / (1.0 + math.exp(x))
+
+def doc_key(doc: Document) -> str:
+    return doc.id or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+class Reranker:
+    """Cross-encoder reranking with a confidence-gated fast path.
+
+    rerank() takes retrieval candidates as (document, vector similarity or
+    None) pairs. If the vector scores already single out one chunk, that
+    chunk is returned without running the model. Otherwise candidates are
+    scored in batches until the time budget runs out, and only chunks above
+    the relevance cutoff are kept. Scores are cached per (query, chunk).
+    A model that fails to load is not retried; later calls keep the
+    retrieval order.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 time_budget_ms: float = RERANK_TIME_BUDGET_MS, min_relevance: float = RERANK_MIN_RELEVANCE,
+                 cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.time_budget = time_budget_ms / 1000.0
+        self.min_relevance = min_relevance
+        self.cache_size = cache_size
+        self._model = None
+        self._load_error: Optional[BaseException] = None
+        self._model_lock = threading.Lock()
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._load_error is not None:
+                    raise RuntimeError(f"Cross-encoder {self.model_name} is unavailable: {self._load_error}")
+                if self._model is None:
+                    try:
+                        from sentence_transformers import CrossEncoder
+                        self._model = CrossEncoder(self.model_name)
+                    except Exception as e:
+                        self._load_error = e
+                        print(f"Cross-encoder {self.model_name} failed to load, reranking disabled: {e}")
+                        raise
+        return self._model
+
+    @property
+    def available(self) -> bool:
+        """False once the model has failed to load."""
+        return self._load_error is None
+
+    def warm(self):
+        """Load the model and run one pair so the first real query stays within budget."""
+        self._predict([("warmup", "warmup")])
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        import torch
+        model = self.model()
+        # Ask for raw logits; the activation keyword was renamed in sentence-transformers 4
+        try:
+            logits = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False,
+                                   activation_fn=torch.nn.Identity())
+        except TypeError:
+            logits = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False,
+                                   activation_fct=torch.nn.Identity())
+        return [_sigmoid(float(x)) for x in logits]
+
+    def score(self, query: str, docs: List[Document], deadline: float) -> Tuple[List[Optional[float]], int]:
+        """Relevance per doc (None if the budget ran out first) and the number of cache hits."""
+        query_key = normalize_query(query)
+        keys = [(query_key, doc_key(doc)) for doc in docs]
+        scores: List[Optional[float]] = [None] * len(docs)
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+        cached = sum(s is not None for s in scores)
+
+        misses = [i for i, s in enumerate(scores) if s is None]
+        for start in range(0, len(misses), self.batch_size):
+            # The first batch always runs so a slow machine still gets some reranking
+            if start and time.perf_counter() >= deadline:
+                break
+            batch = misses[start:start + self.batch_size]
+            batch_scores = self._predict([(query, docs[i].page_content) for i in batch])
+            with self._cache_lock:
+                for i, value in zip(batch, batch_scores):
+                    scores[i] = value
+                    self._scores[keys[i]] = value
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return scores, cached
+
+    def rerank(self, query: str, candidates: List[Tuple[Document, Optional[float]]], k: int) -> Tuple[List[Document], Dict[str, Any]]:
+        start = time.perf_counter()
+        stats: Dict[str, Any] = {"candidates": len(candidates), "skipped": None, "scored": 0, "cached": 0}
+        if len(candidates) <= 1:
+            stats["skipped"] = "single_candidate"
+            stats["kept"] = len(candidates)
+            return [doc for doc, _ in candidates], stats
+        if not self.available:
+            stats["skipped"] = "model_unavailable"
+            stats["kept"] = min(k, len(candidates))
+            return [doc for doc, _ in candidates[:k]], stats
+
+        by_vector = sorted((pair for pair in candidates if pair[1] is not None), key=lambda pair: -pair[1])
+        if len(by_vector) >= 2:
+            top, runner_up = by_vector[0][1], by_vector[1][1]
+            if top >= RERANK_SKIP_MIN_SCORE and top - runner_up >= RERANK_SKIP_MARGIN:
+                stats["skipped"] = "clear_winner"
+                stats["kept"] = 1
+                return [by_vector[0][0]], stats
+
+        docs = [doc for doc, _ in candidates]
+        scores, cached = self.score(query, docs, start + self.time_budget)
+        stats["cached"] = cached
+        stats["scored"] = sum(s is not None for s in scores)
+
+        ranked = sorted((i for i, s in enumerate(scores) if s is not None), key=lambda i: -scores[i])
+        kept = [i for i in ranked if scores[i] >= self.min_relevance][:k]
+        if not kept and ranked:
+            # Nothing cleared the cutoff: the single best chunk still beats an empty context
+            kept = ranked[:1]
+        # Candidates the budget left unscored were never rejected; they fill any remaining slots
+        unscored = [i for i, s in enumerate(scores) if s is None]
+        if len(kept) < k:
+            kept += unscored[:k - len(kept)]
+        stats["kept"] = len(kept)
+        stats["top_relevance"] = round(scores[ranked[0]], 4) if ranked else None
+        stats["seconds"] = round(time.perf_counter() - start, 4)
+        return [docs[i] for i in kept], stats
@@ -0,0 +1,130 @@
+import os
+import re
+import heapq
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Shard stores live in <db_path>/shards/<name>/, each laid out like an unsharded store
+SHARDS_DIR = "shards"
+SHARD_STRATEGIES = ("hash", "source")
+# Extra candidates per shard when results are filtered to a scope after the search
+SCOPE_OVERFETCH = 4
+
+def shard_config(shards: int = 1, shard_by: str = "hash") -> Optional[Dict]:
+    """Manifest record of the shard layout, or None for a single collection."""
+    if shard_by not in SHARD_STRATEGIES:
+        raise ValueError(f"Unknown shard strategy: {shard_by}")
+    if shard_by == "hash" and shards <= 1:
+        return None
+    return {"by": shard_by, "count": shards if shard_by == "hash" else None}
+
+def shard_for(path: str, config: Dict) -> str:
+    """Shard name for a source file. Whole files go to one shard so they can be routed to."""
+    name = os.path.basename(path)
+    if config["by"] == "source":
+        # One shard per document, named after it
+        return re.sub(r"[^A-Za-z0-9_-]+", "_", os.path.splitext(name)[0])
+    bucket = int(hashlib.sha256(name.encode("utf-8")).hexdigest(), 16) % config["count"]
+    return f"shard_{bucket:02d}"
+
+def shard_path(db_path: str, shard: str) -> str:
+    return os.path.join(db_path, SHARDS_DIR, shard)
+
+def resolve_scope(scope: Optional[Sequence[str]], sources: Iterable[str]) -> Optional[List[str]]:
+    """Source paths matching scope names (file name or stem, case-insensitive); None means everything."""
+    if not scope:
+        return None
+    wanted = {name.lower() for name in scope}
+    matched = [path for path in sources
+               if os.path.basename(path).lower() in wanted or os.path.splitext(os.path.basename(path))[0].lower() in wanted]
+    if not matched:
+        print(f"No documents match scope {list(scope)}; searching all documents.")
+        return None
+    return matched
+
+def cosine_search(store: VectorStore, embedding: List[float], k: int,
+                  sources: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+    """(document, cosine similarity) pairs from a Chroma or flat store, optionally limited to sources."""
+    from flat_index import FlatVectorStore
+    if isinstance(store, FlatVectorStore):
+        if not sources:
+            return store.similarity_search_by_vector_with_score(embedding, k=k)
+        allowed = set(sources)
+        pairs = store.similarity_search_by_vector_with_score(embedding, k=k * SCOPE_OVERFETCH)
+        return [pair for pair in pairs if pair[0].metadata.get("source") in allowed][:k]
+    # Chroma returns squared L2 distance; the embeddings are unit length, so cos = 1 - d/2
+    where = {"source": {"$in": list(sources)}} if sources else None
+    pairs = store.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+    return [(doc, 1.0 - distance / 2.0) for doc, distance in pairs]
+
+class ShardedVectorStore(VectorStore):
+    """Read-only view over per-shard stores that fans queries out concurrently.
+
+    Each shard is searched for its own top-k and the results are merged by
+    cosine similarity. Passing `sources` routes the query to only the shards
+    holding those files.
+    """
+
+    def __init__(self, stores: Dict[str, VectorStore], source_shards: Dict[str, str], embedding_function: Embeddings):
+        self.stores = stores
+        self.source_shards = source_shards
+        self._embedding_function = embedding_function
+        # Chunk IDs start with the file's base name (see data_ingestion.chunk_ids_for)
+        self._basename_shards = {os.path.basename(path): shard for path, shard in source_shards.items()}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(stores)), thread_name_prefix="shard")
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def route(self, sources: Optional[List[str]] = None) -> List[str]:
+        if not sources:
+            return list(self.stores)
+        return sorted({self.source_shards[path] for path in sources if self.source_shards.get(path) in self.stores})
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("Sharded stores are written by data_ingestion --shards.")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        raise NotImplementedError("Sharded stores are written by data_ingestion --shards.")
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               sources: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        shards = self.route(sources)
+        if len(shards) == 1:
+            return cosine_search(self.stores[shards[0]], embedding, k, sources)
+        futures = [self.executor.submit(cosine_search, self.stores[shard], embedding, k, sources) for shard in shards]
+        results = [pair for future in futures for pair in future.result()]
+        return heapq.nlargest(k, results, key=lambda pair: pair[1])
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, kwargs.get("sources"))]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k,
+                                                           kwargs.get("sources"))
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def get(self, ids: List[str], include: Optional[List[str]] = None) -> Dict[str, List]:
+        """Chroma-style fetch by ID, asking only the shard that owns each chunk."""
+        by_shard: Dict[str, List[str]] = {}
+        for chunk_id in ids:
+            shard = self._basename_shards.get(chunk_id.split(":", 1)[0])
+            for name in ([shard] if shard in self.stores else list(self.stores)):
+                by_shard.setdefault(name, []).append(chunk_id)
+        result = {"ids": [], "documents": [], "metadatas": []}
+        for shard, shard_ids in by_shard.items():
+            fetched = self.stores[shard].get(ids=shard_ids, include=["documents", "metadatas"])
+            for key in result:
+                result[key].extend(fetched[key])
+        return result
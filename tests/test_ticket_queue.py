@@ -0,0 +1,97 @@
+import time
+import threading
+
+import pytest
+
+import ticket_queue
+from ticket_queue import TicketDispatcher
+
+TOKEN = "test-token"
+REPO = "owner/repo"
+
+class FakeGithubError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+class FakeIssue:
+    def __init__(self, number):
+        self.number = number
+        self.html_url = f"https://github.test/{REPO}/issues/{number}"
+
+class FakeRepo:
+    """Stands in for a PyGithub repo; `failures` are raised in order before issues succeed."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def create_issue(self, title, body, labels):
+        with self.lock:
+            self.calls.append(time.monotonic())
+            if self.failures:
+                raise FakeGithubError(self.failures.pop(0))
+            return FakeIssue(len(self.calls))
+
+def make_dispatcher(tmp_path, repo, **kwargs):
+    kwargs.setdefault("base_delay", 0.05)
+    return TicketDispatcher(db_path=str(tmp_path / "outbox.db"), repo_factory=lambda token, name: repo, **kwargs)
+
+@pytest.fixture
+def dispatchers():
+    started = []
+    yield started
+    for dispatcher in started:
+        dispatcher.stop()
+
+def test_ticket_is_sent(tmp_path, dispatchers):
+    repo = FakeRepo()
+    dispatcher = make_dispatcher(tmp_path, repo)
+    dispatchers.append(dispatcher)
+    ref = dispatcher.submit(TOKEN, REPO, "Broken login", "details", ["support"])
+    info = dispatcher.wait(ref, 5)
+    assert info["status"] == "sent"
+    assert info["attempts"] == 1
+    assert info["issue_url"].endswith("/issues/1")
+
+def test_server_error_is_retried_with_backoff(tmp_path, dispatchers):
+    repo = FakeRepo(failures=[502, 503])
+    dispatcher = make_dispatcher(tmp_path, repo)
+    dispatchers.append(dispatcher)
+    ref = dispatcher.submit(TOKEN, REPO, "Broken login", "details", ["support"])
+    info = dispatcher.wait(ref, 5)
+    assert info["status"] == "sent"
+    assert info["attempts"] == 3
+    first_gap, second_gap = repo.calls[1] - repo.calls[0], repo.calls[2] - repo.calls[1]
+    assert first_gap >= 0.05
+    assert second_gap >= 0.1
+
+@pytest.mark.parametrize("status", [401, 403, 422])
+def test_client_error_fails_without_retry(tmp_path, dispatchers, status):
+    repo = FakeRepo(failures=[status])
+    dispatcher = make_dispatcher(tmp_path, repo)
+    dispatchers.append(dispatcher)
+    ref = dispatcher.submit(TOKEN, REPO, "Broken login", "details", ["support"])
+    info = dispatcher.wait(ref, 5)
+    assert info["status"] == "failed"
+    assert info["attempts"] == 1
+    assert len(repo.calls) == 1
+
+def test_pending_ticket_is_sent_after_restart(tmp_path, dispatchers, monkeypatch):
+    crashed = make_dispatcher(tmp_path, FakeRepo())
+    # The first process records the ticket and dies before its worker runs
+    monkeypatch.setattr(crashed, "start", lambda: None)
+    ref = crashed.submit(TOKEN, REPO, "Broken login", "details", ["support"])
+    assert crashed.status(ref)["status"] == "pending"
+
+    repo = FakeRepo()
+    restarted = make_dispatcher(tmp_path, repo)
+    dispatchers.append(restarted)
+    # Without its token the ticket cannot be sent, and must not keep the worker polling
+    assert restarted._next_wakeup() == ticket_queue.TICKET_RETRY_MAX_DELAY
+    restarted.register_token(TOKEN)
+    restarted.start()
+    info = restarted.wait(ref, 5)
+    assert info["status"] == "sent"
+    assert len(repo.calls) == 1
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+OUTBOX_PATH = os.environ.get("TICKET_OUTBOX_PATH", "ticket_outbox.db")
+# Point at a local stub to exercise the dispatcher without touching GitHub
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+TICKET_MAX_ATTEMPTS = 5
+TICKET_RETRY_BASE_DELAY = 2.0
+TICKET_RETRY_MAX_DELAY = 60.0
+CLIENT_POOL_SIZE = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    ref TEXT PRIMARY KEY,
+    repo TEXT NOT NULL,
+    token_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    issue_url TEXT,
+    issue_number INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL
+)
+"""
+
+def token_id(token: str) -> str:
+    """Tokens are never written to the outbox, only this fingerprint."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def github_repo_factory(token: str, repo_name: str, api_url: str = GITHUB_API_URL):
+    from github import Github
+    return Github(token, base_url=api_url).get_repo(repo_name)
+
+def is_retryable(error: Exception) -> bool:
+    """Auth/permission/not-found errors will not fix themselves; everything else is retried."""
+    status = getattr(error, "status", None)
+    return status not in (401, 403, 404, 410, 422)
+
+def describe_error(error: Exception) -> str:
+    error_msg = str(error)
+    if getattr(error, "status", None) == 403 or "403" in error_msg:
+        return "403 Forbidden. This usually means your GITHUB_TOKEN is missing the 'repo' or 'issues' write scope. Please check your token settings."
+    return error_msg
+
+class TicketDispatcher:
+    """Creates GitHub issues in the background from a durable SQLite outbox.
+
+    submit() records the ticket and returns a reference immediately; a worker
+    thread creates the issue with retries and exponential backoff. Pending
+    tickets survive restarts and are sent once their token is known again
+    (tokens are kept in memory only, and only while they have pending
+    tickets). Repo handles are reused per (token, repo) from a small LRU pool.
+    """
+
+    def __init__(self, db_path: str = OUTBOX_PATH, repo_factory: Callable = github_repo_factory,
+                 max_attempts: int = TICKET_MAX_ATTEMPTS, base_delay: float = TICKET_RETRY_BASE_DELAY):
+        self.db_path = db_path
+        self.repo_factory = repo_factory
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._tokens: Dict[str, str] = {}
+        self._repos: "OrderedDict[tuple, object]" = OrderedDict()
+        self._db_lock = threading.Lock()
+        self._changed = threading.Condition()
+        # Set when new work arrives so a notification sent while the worker is busy is not lost
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def register_token(self, token: str):
+        if token:
+            with self._db_lock:
+                self._tokens[token_id(token)] = token
+            self._notify(new_work=True)
+
+    def _notify(self, new_work: bool = False):
+        with self._changed:
+            if new_work:
+                self._dirty = True
+            self._changed.notify_all()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ticket-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, token: str, repo: str, title: str, body: str, labels: List[str]) -> str:
+        ref = f"TKT-{uuid.uuid4().hex[:8].upper()}"
+        now = time.time()
+        # Token and row go in together so _forget_idle_tokens never sees one without the other
+        with self._db_lock, self._connect() as conn:
+            if token:
+                self._tokens[token_id(token)] = token
+            conn.execute(
+                "INSERT INTO tickets (ref, repo, token_id, title, body, labels, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (ref, repo, token_id(token), title, body, json.dumps(labels), now, now),
+            )
+        self.start()
+        self._notify(new_work=True)
+        return ref
+
+    def status(self, ref: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                "SELECT ref, repo, status, attempts, issue_url, issue_number, error FROM tickets WHERE ref = ?",
+                (ref,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def wait(self, ref: str, timeout: float) -> Optional[Dict]:
+        """Block until the ticket is sent or failed, or until timeout; returns its latest status."""
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                info = self.status(ref)
+                remaining = deadline - time.time()
+                if info is None or info["status"] != "pending" or remaining <= 0:
+                    return info
+                self._changed.wait(remaining)
+
+    def _repo_handle(self, token: str, repo_name: str):
+        key = (token_id(token), repo_name)
+        if key in self._repos:
+            self._repos.move_to_end(key)
+            return self._repos[key]
+        handle = self.repo_factory(token, repo_name)
+        self._repos[key] = handle
+        while len(self._repos) > CLIENT_POOL_SIZE:
+            self._repos.popitem(last=False)
+        return handle
+
+    def _due_tickets(self):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT ref, repo, token_id, title, body, labels, attempts FROM tickets "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY created_at",
+                (time.time(),),
+            ).fetchall()
+        return [row for row in rows if row[2] in self._tokens]
+
+    def _next_wakeup(self) -> float:
+        """Seconds until the next ticket that can actually be sent; tickets whose token is unknown don't count."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT token_id, MIN(next_attempt_at) FROM tickets WHERE status = 'pending' GROUP BY token_id"
+            ).fetchall()
+        due = [next_at for tok_id, next_at in rows if tok_id in self._tokens]
+        if not due:
+            return TICKET_RETRY_MAX_DELAY
+        return min(max(min(due) - time.time(), 0.05), TICKET_RETRY_MAX_DELAY)
+
+    def _forget_idle_tokens(self):
+        """Drop tokens (and their repo handles) that no pending ticket needs any more."""
+        with self._db_lock, self._connect() as conn:
+            pending = {row[0] for row in conn.execute("SELECT DISTINCT token_id FROM tickets WHERE status = 'pending'")}
+            for tok_id in [tok_id for tok_id in self._tokens if tok_id not in pending]:
+                del self._tokens[tok_id]
+                for key in [key for key in self._repos if key[0] == tok_id]:
+                    del self._repos[key]
+
+    def _update(self, ref: str, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._db_lock, self._connect() as conn:
+            conn.execute(f"UPDATE tickets SET {assignments} WHERE ref = ?", (*fields.values(), ref))
+        self._notify()
+
+    def dispatch_once(self) -> int:
+        """Try every due ticket once. Returns how many were attempted."""
+        tickets = self._due_tickets()
+        for ref, repo_name, tok_id, title, body, labels, attempts in tickets:
+            token = self._tokens[tok_id]
+            try:
+                repo = self._repo_handle(token, repo_name)
+                issue = repo.create_issue(title=title, body=body, labels=json.loads(labels))
+                self._update(ref, status="sent", attempts=attempts + 1,
+                             issue_url=issue.html_url, issue_number=issue.number, error=None)
+                print(f"Ticket {ref} created: {issue.html_url}")
+            except Exception as e:
+                attempts += 1
+                # Drop the cached handle in case the client itself is broken
+                self._repos.pop((tok_id, repo_name), None)
+                if attempts >= self.max_attempts or not is_retryable(e):
+                    self._update(ref, status="failed", attempts=attempts, error=describe_error(e))
+                    print(f"Ticket {ref} failed permanently: {e}")
+                else:
+                    delay = min(self.base_delay * 2 ** (attempts - 1), TICKET_RETRY_MAX_DELAY)
+                    self._update(ref, attempts=attempts, next_attempt_at=time.time() + delay, error=describe_error(e))
+                    print(f"Ticket {ref} attempt {attempts} failed, retrying in {delay:.1f}s: {e}")
+        return len(tickets)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._changed:
+                self._dirty = False
+            try:
+                self.dispatch_once()
+                self._forget_idle_tokens()
+                wakeup = self._next_wakeup()
+            except Exception as e:
+                print(f"Ticket dispatcher error: {e}")
+                wakeup = self.base_delay
+            with self._changed:
+                # Work submitted since the pass started is picked up right away
+                if not self._stop.is_set() and not self._dirty:
+                    self._changed.wait(wakeup)
+
+_dispatcher: Optional[TicketDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+def get_ticket_dispatcher() -> TicketDispatcher:
+    """Process-wide dispatcher; picks up tickets left pending by a previous run."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TicketDispatcher()
+            _dispatcher.register_token(os.environ.get("GITHUB_TOKEN"))
+            _dispatcher.start()
+    return _dispatcher
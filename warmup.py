@@ -0,0 +1,91 @@
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+class WarmupState:
+    """Readiness of the RAG engine while it warms up in the background.
+
+    Status goes starting -> warming -> ready (or failed). Chat requests can
+    wait() on it or report snapshot() to the user; stage timings are kept
+    so startup regressions are visible.
+    """
+
+    def __init__(self):
+        self.status = "starting"
+        self.stage: Optional[str] = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.started_at = time.time()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, stage: str):
+        with self._lock:
+            self.status = "warming"
+            self.stage = stage
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[stage] = round(elapsed, 4)
+            print(f"[warmup] {stage}: {elapsed:.2f}s")
+
+    def mark_ready(self):
+        with self._lock:
+            self.status = "ready"
+            self.stage = None
+        self._ready.set()
+        print(f"[warmup] ready in {time.time() - self.started_at:.2f}s ({self.timings})")
+
+    def mark_failed(self, error: Exception):
+        with self._lock:
+            self.status = "failed"
+            self.error = str(error)
+        # Waiters are released; requests then try to initialize on their own
+        self._ready.set()
+        print(f"[warmup] failed: {error}")
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until warmup finished (ready or failed); True if it did within timeout."""
+        return self._ready.wait(timeout)
+
+    async def wait_async(self, timeout: float, poll_interval: float = 0.25) -> bool:
+        """wait() for coroutines: polls instead of parking an executor thread per waiting request."""
+        deadline = time.monotonic() + timeout
+        while not self._ready.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(poll_interval, remaining))
+        return True
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "status": self.status,
+                "stage": self.stage,
+                "error": self.error,
+                "uptime_seconds": round(time.time() - self.started_at, 2),
+                "timings": dict(self.timings),
+            }
+
+def start_background_warmup(target: Callable[[WarmupState], None], state: WarmupState) -> threading.Thread:
+    def run():
+        try:
+            target(state)
+            state.mark_ready()
+        except Exception as e:
+            state.mark_failed(e)
+
+    thread = threading.Thread(target=run, name="rag-warmup", daemon=True)
+    thread.start()
+    return thread